@@ -0,0 +1,265 @@
+"""
+Benchmarks of fdtd_yee_metal
+
+python benchmark.py precision   compare the cantenna radiation patterns computed with float32 and float64 fields
+python benchmark.py courant     compare the cantenna radiation patterns computed with different Courant numbers
+python benchmark.py speed       steps/s, cell updates/s, peak memory and temporary memory per step for
+                                several grid sizes, with and without the cantenna
+python benchmark.py kernels     duration of curl_E, curl_B, timestep, refine_metal, update_radiation_pattern
+                                and poynting for several grid sizes
+python benchmark.py reference   compare the fields after a few steps with reference fields, by default
+                                benchmark_reference.npz (n=30, 100 steps, float64) computed with the time
+                                step of the first commit of the repository (649a811, see baseline_timestep),
+                                or those saved by --save-reference, e.g. before an optimization
+
+Each configuration of speed runs in a new process, so that the peak memory (maximum resident set size,
+not available on Windows) is that of one configuration. The temporary memory is the largest amount
+of memory allocated and freed again during one time step (measured with tracemalloc).
+"""
+
+import numpy, os, time, argparse, concurrent.futures, tracemalloc
+import fdtd_yee_metal, profiler
+
+SIZES = (50, 100, 200, 300)
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_reference.npz')
+
+
+def radiation_patterns(w):
+    """
+    :param w: WaveEquation run until int_stop
+    :return: radiation patterns in the XY, YZ and XZ planes in dB
+    """
+    return 10*numpy.log10(numpy.array([w.pattern_xy, w.pattern_yz, w.pattern_xz])/w.npattern)
+
+
+def pattern_error(patterns, reference, dynamic_range=30):
+    """
+    Compare radiation patterns in the directions where the reference is within dynamic_range dB of its maximum
+    :return: maximum and rms deviation in dB
+    """
+    relevant = reference > numpy.max(reference) - dynamic_range
+    error = (patterns - reference)[relevant]
+    return numpy.max(numpy.abs(error)), numpy.sqrt(numpy.mean(error**2))
+
+
+def precision(n=100, backend='numpy', threads=1):
+    """
+    Run the cantenna simulation with float64 and float32 fields and print the deviation of the radiation patterns
+    """
+    print('%-10s %10s %10s %12s %12s' % ('dtype', 'memory/MB', 'time/s', 'max err/dB', 'rms err/dB'))
+    for dtype in [numpy.float64, numpy.float32]:
+        w = fdtd_yee_metal.dipole_simulation(True, n, backend=backend, threads=threads, dtype=dtype)
+        start = time.perf_counter()
+        w.run(int(numpy.ceil(w.int_stop)))
+        elapsed = time.perf_counter() - start
+        patterns = radiation_patterns(w)
+        if dtype is numpy.float64:
+            reference = patterns
+        max_error, rms_error = pattern_error(patterns, reference)
+        print('%-10s %10.0f %10.2f %12.2e %12.2e' % (numpy.dtype(dtype).name, (w.E.nbytes + w.B.nbytes)/2**20,
+                                                    elapsed, max_error, rms_error))
+
+
+def courant(n=100, backend='numpy', threads=1, courants=(0.1*numpy.sqrt(3), 0.35, 0.7, 0.99)):
+    """
+    Run the cantenna simulation with increasing Courant numbers and print the number of steps, the
+    duration and the deviation of the radiation patterns from those of the first Courant number
+    """
+    print('%-10s %10s %10s %12s %12s' % ('courant', 'steps', 'time/s', 'max err/dB', 'rms err/dB'))
+    for i, number in enumerate(courants):
+        w = fdtd_yee_metal.dipole_simulation(True, n, courant=number, backend=backend, threads=threads)
+        start = time.perf_counter()
+        w.run(int(numpy.ceil(w.int_stop)))
+        elapsed = time.perf_counter() - start
+        patterns = radiation_patterns(w)
+        if i == 0:
+            reference = patterns
+        max_error, rms_error = pattern_error(patterns, reference)
+        print('%-10.3f %10d %10.2f %12.2e %12.2e' % (number, w.index, elapsed, max_error, rms_error))
+
+
+def _speed(n, put_cantenna, steps, backend, threads, dtype):
+    w = fdtd_yee_metal.dipole_simulation(put_cantenna, n, backend=backend, threads=threads, dtype=dtype)
+    # the first step compiles the numba kernels and allocates the work buffers
+    w.step()
+    start = time.perf_counter()
+    for i in range(steps):
+        w.step()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        current = tracemalloc.get_traced_memory()[0]
+        w.step()
+        temporary = tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return steps / elapsed, profiler.peak_memory(), temporary
+
+
+def speed(sizes=SIZES, steps=10, backend='numpy', threads=1, dtype=numpy.float64):
+    """
+    Time steps of the dipole simulation with and without cantenna for each grid size in sizes
+    :param steps: number of timed steps per configuration
+    """
+    print('%-6s %-6s %10s %14s %12s %12s' % ('n', 'metal', 'steps/s', 'Mcells/s', 'peak/MB', 'temp/MB'))
+    for n in sizes:
+        for put_cantenna in [False, True]:
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                rate, peak, temporary = executor.submit(_speed, n, put_cantenna, steps, backend, threads,
+                                                        dtype).result()
+            print('%-6d %-6s %10.2f %14.1f %12.0f %12.1f' % (n, put_cantenna, rate, rate * n**3 / 1e6,
+                                                              peak / 2**20, temporary / 2**20))
+
+
+def _duration(function, repeat=5):
+    """
+    :return: shortest duration of function() in s over repeat calls
+    """
+    durations = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def kernels(sizes=SIZES, dtype=numpy.float64, repeat=5):
+    """
+    Print the duration of the functions of fdtd_yee_metal called at each time step for each grid size
+    in sizes, with random fields and the cantenna of dipole_simulation
+    """
+    names = ['curl_E', 'curl_B', 'timestep', 'refine_metal', 'radiation', 'poynting']
+    print('%-6s' % 'n' + ''.join('%14s' % name for name in names) + '   (ms)')
+    for n in sizes:
+        w = fdtd_yee_metal.dipole_simulation(True, n, dtype=dtype)
+        random = numpy.random.default_rng(0)
+        E = random.standard_normal(w.E.shape).astype(dtype)
+        B = random.standard_normal(w.B.shape).astype(dtype)
+        w.E[...], w.B[...] = E, B
+        work = fdtd_yee_metal.work_buffers(E.shape, dtype)
+        source_pos, source_val = w.source(0)
+        is_metal = numpy.zeros(E.shape[:3], dtype=bool)
+        is_metal[w.metal[:3]] = True
+        durations = [_duration(lambda: fdtd_yee_metal.curl_E(E, *work), repeat),
+                     _duration(lambda: fdtd_yee_metal.curl_B(B, *work), repeat),
+                     _duration(lambda: fdtd_yee_metal.timestep(E, B, w.c, source_pos, source_val, w.metal, work),
+                               repeat),
+                     _duration(lambda: fdtd_yee_metal.refine_metal(is_metal), repeat),
+                     _duration(w.update_radiation_pattern, repeat),
+                     _duration(lambda: fdtd_yee_metal.poynting(E, B), repeat)]
+        print('%-6d' % n + ''.join('%14.2f' % (d * 1e3) for d in durations))
+        del w, E, B, work
+
+
+def baseline_timestep(E, B, c, source_pos, source_val, metal_pos, region=None, profiler=None):
+    """
+    fdtd_yee_metal.timestep of commit 649a811, before any optimization, used to compute the reference
+    fields. region and profiler are ignored.
+    """
+    def curl_E(E):
+        curl_E = numpy.zeros(E.shape)
+        curl_E[:, :-1, :, 0] += E[:, 1:, :, 2] - E[:, :-1, :, 2]
+        curl_E[:, :, :-1, 0] -= E[:, :, 1:, 1] - E[:, :, :-1, 1]
+
+        curl_E[:, :, :-1, 1] += E[:, :, 1:, 0] - E[:, :, :-1, 0]
+        curl_E[:-1, :, :, 1] -= E[1:, :, :, 2] - E[:-1, :, :, 2]
+
+        curl_E[:-1, :, :, 2] += E[1:, :, :, 1] - E[:-1, :, :, 1]
+        curl_E[:, :-1, :, 2] -= E[:, 1:, :, 0] - E[:, :-1, :, 0]
+        return curl_E
+
+    def curl_B(B):
+        curl_B = numpy.zeros(B.shape)
+
+        curl_B[:,1:,:,0] += B[:,1:,:,2] - B[:,:-1,:,2]
+        curl_B[:,:,1:,0] -= B[:,:,1:,1] - B[:,:,:-1,1]
+
+        curl_B[:,:,1:,1] += B[:,:,1:,0] - B[:,:,:-1,0]
+        curl_B[1:,:,:,1] -= B[1:,:,:,2] - B[:-1,:,:,2]
+
+        curl_B[1:,:,:,2] += B[1:,:,:,1] - B[:-1,:,:,1]
+        curl_B[:,1:,:,2] -= B[:,1:,:,0] - B[:,:-1,:,0]
+        return curl_B
+
+    E += c * curl_B(B)
+
+    E[source_pos] += source_val
+
+    E[metal_pos] = 0
+
+    B -= c * curl_E(E)
+
+    return E, B
+
+
+def baseline_fields(n=30, steps=100):
+    """
+    :return: E and B after steps time steps of the dipole simulation in a can computed with baseline_timestep
+    """
+    w = fdtd_yee_metal.dipole_simulation(True, n)
+    w.timestep = baseline_timestep
+    w.run(steps)
+    return w.E, w.B
+
+
+def reference(filename=REFERENCE, n=30, steps=100, save=False, backend='numpy', threads=1, dtype=numpy.float64):
+    """
+    Run steps time steps of the dipole simulation in a can and compare the fields with the reference
+    fields: those saved in filename, or those of baseline_fields if filename does not exist
+    :param save: save the fields in filename instead
+    :return: largest deviation of E and B relative to the largest field of the reference, 0 when saving
+    """
+    w = fdtd_yee_metal.dipole_simulation(True, n, backend=backend, threads=threads, dtype=dtype)
+    w.run(steps)
+    if save:
+        numpy.savez_compressed(filename, n=n, steps=steps, E=w.E, B=w.B)
+        return 0
+    if os.path.exists(filename):
+        with numpy.load(filename) as saved:
+            if int(saved['n']) != n or int(saved['steps']) != steps:
+                raise ValueError('%s was saved with n=%d and %d steps' % (filename, saved['n'], saved['steps']))
+            E, B = saved['E'], saved['B']
+    else:
+        E, B = baseline_fields(n, steps)
+    return max(numpy.max(numpy.abs(w.E - E)) / numpy.max(numpy.abs(E)),
+               numpy.max(numpy.abs(w.B - B)) / numpy.max(numpy.abs(B)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of fdtd_yee_metal')
+    parser.add_argument('benchmark', choices=['precision', 'courant', 'speed', 'kernels', 'reference'])
+    parser.add_argument('-n', type=int, nargs='+', default=None,
+                        help='grid size n x n x n, several sizes for speed and kernels (default: %s, 30 for '
+                             'reference, 100 otherwise)' % ' '.join(map(str, SIZES)))
+    parser.add_argument('--threads', type=int, default=1, help='number of threads used for the simulation')
+    parser.add_argument('--backend', choices=['numpy', 'numba'], default='numpy',
+                        help='implementation of the time step')
+    parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64', help='floating point type of the fields')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='number of time steps for speed (default 10) and reference (default 100)')
+    parser.add_argument('--reference', default=REFERENCE,
+                        help='file of the reference fields, computed with baseline_timestep if it does not exist '
+                             '(default: benchmark_reference.npz next to benchmark.py)')
+    parser.add_argument('--save-reference', action='store_true', help='save the reference fields instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=1e-12,
+                        help='largest relative deviation from the reference fields accepted')
+    args = parser.parse_args()
+    dtype = numpy.dtype(args.dtype)
+    if args.benchmark == 'precision':
+        precision(100 if args.n is None else args.n[0], args.backend, args.threads)
+    elif args.benchmark == 'courant':
+        courant(100 if args.n is None else args.n[0], args.backend, args.threads)
+    elif args.benchmark == 'speed':
+        speed(SIZES if args.n is None else args.n, 10 if args.steps is None else args.steps, args.backend,
+              args.threads, dtype)
+    elif args.benchmark == 'kernels':
+        kernels(SIZES if args.n is None else args.n, dtype)
+    elif args.benchmark == 'reference':
+        deviation = reference(args.reference, 30 if args.n is None else args.n[0],
+                              100 if args.steps is None else args.steps, args.save_reference, args.backend,
+                              args.threads, dtype)
+        if args.save_reference:
+            print('saved %s' % args.reference)
+        else:
+            print('relative deviation %.3g: %s' % (deviation, 'ok' if deviation <= args.tolerance else 'FAILED'))
+            exit(0 if deviation <= args.tolerance else 1)
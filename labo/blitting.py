@@ -0,0 +1,59 @@
+"""
+Redraw of the changing artists of a figure, for fiddle.py and live_plotter.py
+
+The whole figure is drawn once with the artists that change from one frame to the next marked as
+animated. The figure without them is then saved, and the following frames only draw these artists
+on top of the saved background (blitting).
+"""
+
+
+class Blitter:
+
+    def __init__(self, canvas, figure, profiler=None):
+        """
+        :param canvas: canvas of figure
+        :param profiler: optional profiler.Profiler, the drawing is then timed as the phase draw
+        """
+        self.canvas = canvas
+        self.figure = figure
+        self.profiler = profiler
+        # animated artists and the figure without them
+        self.artists = None
+        self.background = None
+        # set to True to draw the whole figure with the next frame, e.g. when the axes change
+        self.full_redraw = True
+        canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        # after a full redraw (also when the window is resized), save the figure without the
+        # animated artists and draw them on top
+        if self.artists is not None:
+            self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+            for artist in self.artists:
+                self.figure.draw_artist(artist)
+
+    def draw(self, artists):
+        """
+        Draw a frame
+        :param artists: list of the artists changed since the last frame, None to draw the whole figure
+        """
+        if self.profiler is not None:
+            t = self.profiler.clock()
+        if artists is None:
+            self.artists = None
+            self.canvas.draw()
+        elif self.full_redraw or self.background is None or list(artists) != self.artists:
+            self.artists = list(artists)
+            for artist in self.artists:
+                artist.set_animated(True)
+            # saved again by on_draw
+            self.background = None
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            for artist in self.artists:
+                self.figure.draw_artist(artist)
+            self.canvas.blit(self.figure.bbox)
+        self.full_redraw = False
+        if self.profiler is not None:
+            self.profiler.lap('draw', t)
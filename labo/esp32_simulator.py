@@ -0,0 +1,87 @@
+"""
+Simulated ESP32 running SignalPower.ino on a pseudo-terminal, to test serial_plotter.py without
+hardware (Linux and macOS)
+
+python esp32_simulator.py --scan-rate 40 --access-points 20
+
+prints the name of the serial port, which is then given to serial_plotter.py.
+"""
+
+import numpy, os, time, threading, argparse, select
+
+SECURITY = ['open', 'WEP', 'WPA', 'WPA2', 'WPA+WPA2', 'WPA2-EAP', 'WPA3', 'WPA2+WPA3']
+
+
+class SimulatedESP32:
+
+    def __init__(self, access_points=8, scan_rate=0.4, seed=None):
+        """
+        :param access_points: number of access points
+        :param scan_rate: scans per second, a real device does about 0.4
+        :param seed: seed of the random access points and power fluctuations
+        """
+        import pty, tty
+        self.master, self.slave = pty.openpty()
+        # no echo and no conversion of the line ends, like a serial port
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.random = numpy.random.default_rng(seed)
+        self.ssid = ['Network %d' % i if i % 2 else 'AP%d' % i for i in range(access_points)]
+        self.security = self.random.choice(SECURITY, access_points)
+        self.channel = self.random.integers(1, 14, access_points)
+        self.rssi = self.random.uniform(-85, -40, access_points)
+        self.scan_rate = scan_rate
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def scan(self):
+        """
+        :return: lines printed by SignalPower.ino for one scan, the power fluctuates and some
+                 access points are missed
+        """
+        found = numpy.flatnonzero(self.random.random(len(self.ssid)) > 0.1)
+        rssi = numpy.round(self.rssi[found] + self.random.normal(0, 3, len(found))).astype(int)
+        lines = ['ssid=%s security=%s channel=%d rssi=%d\n' % (self.ssid[i], self.security[i], self.channel[i], r)
+                 for i, r in zip(found, rssi)]
+        lines.append('Scan complete, found %d APs.\n' % len(found))
+        return ''.join(lines).encode()
+
+    def run(self):
+        next_scan = time.time()
+        while True:
+            next_scan += 1 / self.scan_rate
+            if self.stopped.wait(max(0, next_scan - time.time())):
+                return
+            self.write(self.scan())
+
+    def write(self, data):
+        # wait while the buffer of the port is full, but stop when closed
+        while data and not self.stopped.is_set():
+            if select.select([], [self.master], [], 0.1)[1]:
+                try:
+                    data = data[os.write(self.master, data):]
+                except BlockingIOError:
+                    pass
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Simulated ESP32 running SignalPower.ino on a pseudo-terminal')
+    parser.add_argument('--access-points', type=int, default=8, help='number of access points')
+    parser.add_argument('--scan-rate', type=float, default=0.4, help='scans per second')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the random numbers')
+    args = parser.parse_args()
+    device = SimulatedESP32(args.access_points, args.scan_rate, args.seed)
+    print(device.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        device.close()
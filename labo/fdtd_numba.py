@@ -0,0 +1,169 @@
+"""
+Compiled time step for fdtd_yee_metal, requires numba.
+
+The curl, the update of the field and the metal boundary condition are fused in a single loop
+per field, so that E and B are read and written only once per time step.
+"""
+
+import numpy, numba, numba.extending, numba.np.numpy_support, fdtd_yee_metal
+
+
+@numba.njit(inline='always')
+def flush(x, tiny):
+    """
+    Flush subnormal numbers to zero. In single precision the tails of the wavefronts otherwise
+    become subnormal, which slows down the arithmetic by an order of magnitude.
+    """
+    return x if abs(x) >= tiny else x - x
+
+
+def scale(x, d, i):
+    """
+    x / d[i] in the floating point type of x, or x if d is None (uniform grid, compiled without
+    the division). The division and the rounding are those of numpy in fdtd_yee_metal.curl_E.
+    """
+    return x if d is None else type(x)(x / d[i])
+
+
+@numba.extending.overload(scale, inline='always')
+def _scale(x, d, i):
+    if isinstance(d, numba.types.NoneType):
+        return lambda x, d, i: x
+    cast = numba.np.numpy_support.as_dtype(x).type
+    return lambda x, d, i: cast(x / d[i])
+
+
+@numba.njit(parallel=True, cache=True, nogil=True)
+def update_E(E, B, c, metal, tiny, lo, hi, dx, dy, dz):
+    """
+    E += c * curl_B(B), then set the components flagged in the metal bitmask to 0,
+    in the box lo <= (i, j, k) < hi. dx, dy, dz are the distances between the centers of
+    the cells along each axis (None for a uniform grid).
+    """
+    zero = c - c  # has the floating point type of the fields
+    for i in numba.prange(lo[0], hi[0]):
+        for j in range(lo[1], hi[1]):
+            for k in range(lo[2], hi[2]):
+                m = metal[i, j, k]
+                if m & 1:
+                    E[i, j, k, 0] = 0
+                else:
+                    curl = zero
+                    if j > 0:
+                        curl = scale(B[i, j, k, 2] - B[i, j-1, k, 2], dy, j)
+                    if k > 0:
+                        curl = curl - scale(B[i, j, k, 1] - B[i, j, k-1, 1], dz, k)
+                    E[i, j, k, 0] = flush(E[i, j, k, 0] + c * curl, tiny)
+                if m & 2:
+                    E[i, j, k, 1] = 0
+                else:
+                    curl = zero
+                    if k > 0:
+                        curl = scale(B[i, j, k, 0] - B[i, j, k-1, 0], dz, k)
+                    if i > 0:
+                        curl = curl - scale(B[i, j, k, 2] - B[i-1, j, k, 2], dx, i)
+                    E[i, j, k, 1] = flush(E[i, j, k, 1] + c * curl, tiny)
+                if m & 4:
+                    E[i, j, k, 2] = 0
+                else:
+                    curl = zero
+                    if i > 0:
+                        curl = scale(B[i, j, k, 1] - B[i-1, j, k, 1], dx, i)
+                    if j > 0:
+                        curl = curl - scale(B[i, j, k, 0] - B[i, j-1, k, 0], dy, j)
+                    E[i, j, k, 2] = flush(E[i, j, k, 2] + c * curl, tiny)
+
+
+@numba.njit(parallel=True, cache=True, nogil=True)
+def update_B(E, B, c, tiny, lo, hi, dx, dy, dz):
+    """
+    B -= c * curl_E(E) in the box lo <= (i, j, k) < hi. dx, dy, dz are the distances
+    between the grid nodes along each axis (None for a uniform grid).
+    """
+    nx, ny, nz = E.shape[:3]
+    zero = c - c  # has the floating point type of the fields
+    for i in numba.prange(lo[0], hi[0]):
+        for j in range(lo[1], hi[1]):
+            for k in range(lo[2], hi[2]):
+                curl = zero
+                if j < ny-1:
+                    curl = scale(E[i, j+1, k, 2] - E[i, j, k, 2], dy, j)
+                if k < nz-1:
+                    curl = curl - scale(E[i, j, k+1, 1] - E[i, j, k, 1], dz, k)
+                B[i, j, k, 0] = flush(B[i, j, k, 0] - c * curl, tiny)
+
+                curl = zero
+                if k < nz-1:
+                    curl = scale(E[i, j, k+1, 0] - E[i, j, k, 0], dz, k)
+                if i < nx-1:
+                    curl = curl - scale(E[i+1, j, k, 2] - E[i, j, k, 2], dx, i)
+                B[i, j, k, 1] = flush(B[i, j, k, 1] - c * curl, tiny)
+
+                curl = zero
+                if i < nx-1:
+                    curl = scale(E[i+1, j, k, 1] - E[i, j, k, 1], dx, i)
+                if j < ny-1:
+                    curl = curl - scale(E[i, j+1, k, 0] - E[i, j, k, 0], dy, j)
+                B[i, j, k, 2] = flush(B[i, j, k, 2] - c * curl, tiny)
+
+
+class NumbaTimestep:
+    """
+    Compiled replacement for fdtd_yee_metal.timestep giving the same results, except that
+    subnormal numbers are flushed to zero.
+    The metal positions are converted once to a bitmask (see fdtd_yee_metal.metal_mask).
+    """
+
+    def __init__(self, shape, threads=None, spacing=None):
+        """
+        :param shape: shape of the field arrays (x, y, z, field_component)
+        :param threads: number of threads, default is the number of CPUs
+        :param spacing: optional per-axis spacing arrays of a graded mesh (see fdtd_yee_metal.timestep)
+        """
+        self.shape = shape
+        self.metal_pos = None
+        if spacing is None:
+            self.distances = self.dual_distances = [None] * 3
+        else:
+            # distances between the grid nodes and between the centers of the cells, the first
+            # element of the latter is not used
+            spacing = [numpy.asarray(h, dtype=float) for h in spacing]
+            self.distances = spacing
+            self.dual_distances = [numpy.concatenate([[1.0], 0.5 * (h[:-1] + h[1:])]) for h in spacing]
+        self.threads = None if threads is None else min(threads, numba.config.NUMBA_NUM_THREADS)
+
+    def __call__(self, E, B, c, source_pos, source_val, metal_pos, region=None, profiler=None):
+        """
+        Propagate E and B field by 1 full time step, see fdtd_yee_metal.timestep for the parameters.
+        With a profiler, the metal is counted in curl_B, as it is applied by the same kernel.
+        """
+        if profiler is not None:
+            t = profiler.clock()
+        if self.threads is not None:
+            # the number of threads is thread local, the time step may run in a worker thread
+            numba.set_num_threads(self.threads)
+        lo, hi = ((0, 0, 0), self.shape[:3]) if region is None else region
+        lo = tuple(int(l) for l in lo)
+        hi = tuple(int(h) for h in hi)
+        if metal_pos is not self.metal_pos:
+            self.metal = fdtd_yee_metal.metal_mask(metal_pos, self.shape)
+            self.metal_pos = metal_pos
+        # compute in the floating point type of the fields like numpy does
+        c = E.dtype.type(c)
+        tiny = numpy.finfo(E.dtype).tiny
+        update_E(E, B, c, self.metal, tiny, lo, hi, *self.dual_distances)
+        if profiler is not None:
+            t = profiler.lap('curl_B', t)
+
+        # the source is added after the metal condition, so it must not be added inside the metal
+        source_pos = tuple(numpy.asarray(p) for p in source_pos)
+        E[source_pos] += source_val
+        is_metal = (self.metal[source_pos[:3]] >> source_pos[3]) & 1
+        E[source_pos] = numpy.where(is_metal, 0, E[source_pos])
+        if profiler is not None:
+            t = profiler.lap('inject', t)
+
+        update_B(E, B, c, tiny, lo, hi, *self.distances)
+        if profiler is not None:
+            profiler.lap('curl_E', t)
+        return E, B
@@ -1,6 +1,7 @@
 # GPL3, Copyright (c) Max Hofheinz, GEGI, UdeS, 2021
 
-import numpy, fiddle, matplotlib, matplotlib.pyplot
+import numpy, os, tempfile, argparse, functools, concurrent.futures, matplotlib, matplotlib.figure, matplotlib.image, matplotlib.pyplot
+import ntff, geometry, profiler
 from scipy import constants
 
 EFIELD = 0
@@ -11,45 +12,155 @@ METAL = 4
 NORM=3
 DECIBEL=4
 
-def curl_E(E):
+def work_buffers(shape, dtype=float):
+    """
+    Allocate the work buffers used by curl_E, curl_B and timestep
+    :param shape: shape of the field arrays (x, y, z, field_component)
+    :return: (curl, scratch) where curl has the shape of the fields and scratch is a flat
+             buffer large enough to hold one component of the field
+    """
+    return numpy.zeros(shape, dtype=dtype), numpy.empty(numpy.prod(shape[:-1]), dtype=dtype)
+
+def _add_difference(target, a, b, work, step=None):
+    """target += (a - b) / step, using the flat buffer work for the difference"""
+    diff = work[:a.size].reshape(a.shape)
+    numpy.subtract(a, b, out=diff)
+    if step is not None:
+        numpy.divide(diff, step, out=diff)
+    numpy.add(target, diff, out=target)
+
+def _subtract_difference(target, a, b, work, step=None):
+    """target -= (a - b) / step, using the flat buffer work for the difference"""
+    diff = work[:a.size].reshape(a.shape)
+    numpy.subtract(a, b, out=diff)
+    if step is not None:
+        numpy.divide(diff, step, out=diff)
+    numpy.subtract(target, diff, out=target)
+
+def _steps(spacing, dual):
+    """
+    Distances between the positions of the differences along each axis, shaped for broadcasting
+    :param spacing: per-axis spacing arrays (see graded_mesh), None for a uniform grid
+    :param dual: False for the distances between grid nodes (curl_E), True for the distances
+                 between the centers of the cells (curl_B)
+    :return: list of 3 arrays, or of 3 None for a uniform grid
+    """
+    if spacing is None:
+        return [None] * 3
+    steps = []
+    for axis, h in enumerate(spacing):
+        h = numpy.asarray(h)
+        step = 0.5 * (h[:-1] + h[1:]) if dual else h[:-1]
+        shape = [1, 1, 1]
+        shape[axis] = step.size
+        steps.append(step.reshape(shape))
+    return steps
+
+def curl_E(E, out=None, work=None, spacing=None):
     """
     Calculate curl of E
     :param E: E field on Yee grid positions. E is a 4-d array with indices (x, y, z, field_compoent)
+    :param out: optional array with the shape of E in which the result is written
+    :param work: optional flat scratch buffer (see work_buffers). With out and work given, no memory is allocated.
+    :param spacing: optional per-axis arrays of the distances between grid nodes for a graded mesh (see graded_mesh)
     :return: curl of E at Yee grid positions of B field.
     """
+    if out is None:
+        curl_E = numpy.zeros(E.shape, dtype=E.dtype)
+    else:
+        curl_E = out
+        curl_E.fill(0)
+    if work is None:
+        work = numpy.empty(numpy.prod(E.shape[:-1]), dtype=E.dtype)
+    dx, dy, dz = _steps(spacing, False)
+    _add_difference(curl_E[:, :-1, :, 0], E[:, 1:, :, 2], E[:, :-1, :, 2], work, dy)
+    _subtract_difference(curl_E[:, :, :-1, 0], E[:, :, 1:, 1], E[:, :, :-1, 1], work, dz)
 
-    curl_E = numpy.zeros(E.shape)
-    curl_E[:, :-1, :, 0] += E[:, 1:, :, 2] - E[:, :-1, :, 2]
-    curl_E[:, :, :-1, 0] -= E[:, :, 1:, 1] - E[:, :, :-1, 1]
-
-    curl_E[:, :, :-1, 1] += E[:, :, 1:, 0] - E[:, :, :-1, 0]
-    curl_E[:-1, :, :, 1] -= E[1:, :, :, 2] - E[:-1, :, :, 2]
+    _add_difference(curl_E[:, :, :-1, 1], E[:, :, 1:, 0], E[:, :, :-1, 0], work, dz)
+    _subtract_difference(curl_E[:-1, :, :, 1], E[1:, :, :, 2], E[:-1, :, :, 2], work, dx)
 
-    curl_E[:-1, :, :, 2] += E[1:, :, :, 1] - E[:-1, :, :, 1]
-    curl_E[:, :-1, :, 2] -= E[:, 1:, :, 0] - E[:, :-1, :, 0]
+    _add_difference(curl_E[:-1, :, :, 2], E[1:, :, :, 1], E[:-1, :, :, 1], work, dx)
+    _subtract_difference(curl_E[:, :-1, :, 2], E[:, 1:, :, 0], E[:, :-1, :, 0], work, dy)
     return curl_E
 
-def curl_B(B):
+def curl_B(B, out=None, work=None, spacing=None):
     """
     Calculate curl of B
     :param B: B field on Yee grid positions. B is a 4-d array with indices (x, y, z, field_component)
+    :param out: optional array with the shape of B in which the result is written
+    :param work: optional flat scratch buffer (see work_buffers). With out and work given, no memory is allocated.
+    :param spacing: optional per-axis arrays of the distances between grid nodes for a graded mesh (see graded_mesh)
     :return: curl of B at Yee grid positions of E field.
     """
-    curl_B = numpy.zeros(B.shape)
+    if out is None:
+        curl_B = numpy.zeros(B.shape, dtype=B.dtype)
+    else:
+        curl_B = out
+        curl_B.fill(0)
+    if work is None:
+        work = numpy.empty(numpy.prod(B.shape[:-1]), dtype=B.dtype)
+    dx, dy, dz = _steps(spacing, True)
 
-    curl_B[:,1:,:,0] += B[:,1:,:,2] - B[:,:-1,:,2]
-    curl_B[:,:,1:,0] -= B[:,:,1:,1] - B[:,:,:-1,1]
+    _add_difference(curl_B[:,1:,:,0], B[:,1:,:,2], B[:,:-1,:,2], work, dy)
+    _subtract_difference(curl_B[:,:,1:,0], B[:,:,1:,1], B[:,:,:-1,1], work, dz)
 
-    curl_B[:,:,1:,1] += B[:,:,1:,0] - B[:,:,:-1,0]
-    curl_B[1:,:,:,1] -= B[1:,:,:,2] - B[:-1,:,:,2]
+    _add_difference(curl_B[:,:,1:,1], B[:,:,1:,0], B[:,:,:-1,0], work, dz)
+    _subtract_difference(curl_B[1:,:,:,1], B[1:,:,:,2], B[:-1,:,:,2], work, dx)
 
-    curl_B[1:,:,:,2] += B[1:,:,:,1] - B[:-1,:,:,1]
-    curl_B[:,1:,:,2] -= B[:,1:,:,0] - B[:,:-1,:,0]
+    _add_difference(curl_B[1:,:,:,2], B[1:,:,:,1], B[:-1,:,:,1], work, dx)
+    _subtract_difference(curl_B[:,1:,:,2], B[:,1:,:,0], B[:,:-1,:,0], work, dy)
     return curl_B
 
-def poynting(E, B):
-    """Calculate Poynting vector from E and B"""
+def graded_mesh(size, fine_regions, fine, ratio=1.2):
+    """
+    Distances between the grid nodes along one axis of a graded mesh: fine in the given regions and
+    growing geometrically by at most ratio per cell up to 1 away from them.
+    :param size: length of the axis in units of the (coarse) space step
+    :param fine_regions: list of (start, stop) intervals, in units of the space step, meshed with the fine step
+    :param fine: fine step in units of the space step, <= 1
+    :param ratio: maximum ratio between the sizes of neighbouring cells
+    :return: array of distances, the last element is the distance beyond the last node (see grid_nodes)
+    """
+    def distance(x):
+        return min([max(start - x, 0, x - stop) for start, stop in fine_regions] + [numpy.inf])
+
+    spacing = []
+    x = 0.0
+    while x < size:
+        h = min(1.0, fine + (ratio - 1) * distance(x))
+        # do not step over the beginning of a fine region
+        h = min(h, fine + (ratio - 1) * distance(x + h))
+        spacing.append(h)
+        x += h
+    spacing.append(spacing[-1])
+    return numpy.array(spacing)
+
+def grid_nodes(spacing):
+    """
+    :param spacing: distances between the grid nodes along one axis (see graded_mesh)
+    :return: positions of the grid nodes, starting at 0
+    """
+    return numpy.concatenate([[0], numpy.cumsum(spacing[:-1])])
+
+def cell_edges(nodes):
+    """
+    :param nodes: positions of the grid nodes along one axis (see grid_nodes)
+    :return: boundaries of the cells centred on the nodes, halfway between neighbouring nodes
+    """
+    if len(nodes) < 2:
+        return nodes[0] + numpy.array([-0.5, 0.5])
+    middle = (nodes[1:] + nodes[:-1]) / 2
+    return numpy.concatenate([[2*nodes[0] - middle[0]], middle, [2*nodes[-1] - middle[-1]]])
+
+def poynting(E, B, dtype=None):
+    """
+    Calculate Poynting vector from E and B
+    :param dtype: floating point type used for the calculation, default is the type of E and B
+    """
     mu0 = 0.0000001 * 4 * numpy.pi;
+    if dtype is not None:
+        E = E.astype(dtype, copy=False)
+        B = B.astype(dtype, copy=False)
     return numpy.multiply(1/mu0, numpy.cross(E, B))
     
 
@@ -69,10 +180,49 @@ def refine_metal(is_metal):
     is_metal[:,:-1,:,1] &= is_metal[:,1:,:,1]
     is_metal[:,:,:-1,2] &= is_metal[:,:,1:,2]
     return numpy.nonzero(is_metal)
+
+def metal_mask(metal_pos, shape):
+    """
+    Convert the metal positions returned by refine_metal to a compact bitmask
+    :param metal_pos: metal positions (see refine_metal)
+    :param shape: shape of the grid, only the first 3 elements are used
+    :return: uint8 array of shape shape[:3], bit i is set if field component i is in the metal
+    """
+    mask = numpy.zeros(shape[:3], dtype=numpy.uint8)
+    numpy.bitwise_or.at(mask, metal_pos[:3], numpy.left_shift(1, metal_pos[3]).astype(numpy.uint8))
+    return mask
     
 
 
-def timestep(E, B, c, source_pos, source_val, metal_pos):
+def update_E(E, B, c, work, lo, hi, spacing=None):
+    """
+    E += c * curl_B(B) in the box lo <= (x, y, z) < hi, using the work buffers (see work_buffers)
+    """
+    # the curl of B needs one more voxel of B below the box
+    start = [max(l-1, 0) for l in lo]
+    view = B[start[0]:hi[0], start[1]:hi[1], start[2]:hi[2]]
+    if spacing is not None:
+        spacing = [h[a:b] for h, a, b in zip(spacing, start, hi)]
+    curl = work[0][:view.shape[0], :view.shape[1], :view.shape[2]]
+    numpy.multiply(curl_B(view, curl, work[1], spacing), c, out=curl)
+    box = E[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+    numpy.add(box, curl[lo[0]-start[0]:, lo[1]-start[1]:, lo[2]-start[2]:], out=box)
+
+def update_B(E, B, c, work, lo, hi, spacing=None):
+    """
+    B -= c * curl_E(E) in the box lo <= (x, y, z) < hi, using the work buffers (see work_buffers)
+    """
+    # the curl of E needs one more voxel of E above the box
+    stop = [min(h+1, n) for h, n in zip(hi, E.shape)]
+    view = E[lo[0]:stop[0], lo[1]:stop[1], lo[2]:stop[2]]
+    if spacing is not None:
+        spacing = [h[a:b] for h, a, b in zip(spacing, lo, stop)]
+    curl = work[0][:view.shape[0], :view.shape[1], :view.shape[2]]
+    numpy.multiply(curl_E(view, curl, work[1], spacing), c, out=curl)
+    box = B[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+    numpy.subtract(box, curl[:hi[0]-lo[0], :hi[1]-lo[1], :hi[2]-lo[2]], out=box)
+
+def timestep(E, B, c, source_pos, source_val, metal_pos, work=None, region=None, spacing=None, profiler=None):
     """
     Propagate E and B field by 1 full time step
     :param E: renormalized electric field  (4-d array with indices (x, y, z, field_component)) on Yee grid
@@ -80,6 +230,12 @@ def timestep(E, B, c, source_pos, source_val, metal_pos):
     :param c: renormalized speed of light in units of space_step/time_step, must be < 1/sqrt(3)
     :param source_pos: positions of source terms
     :param source_val: values of source terms
+    :param work: optional work buffers (see work_buffers). If given, E and B are updated in place
+                 without allocating memory.
+    :param region: optional box (lo, hi) outside of which the fields are not updated
+    :param spacing: optional per-axis arrays of the distances between grid nodes for a graded mesh,
+                    in units of space_step (see graded_mesh). c must then be < min(spacing)/sqrt(3).
+    :param profiler: optional profiler.Profiler timing the phases curl_B, inject, metal and curl_E
     :return: renormalized electric field, renormalized magnetic field
 
     RENORMALIZATION:
@@ -95,138 +251,594 @@ def timestep(E, B, c, source_pos, source_val, metal_pos):
     The speed of light c is given in units of space_step/time_step. To get back the speed of light in m/s:
     speed of light in m/s: c * space_step/time_step
     """
-    E += c * curl_B(B)
+    if profiler is not None:
+        t = profiler.clock()
+    if work is None and region is None:
+        E += c * curl_B(B, spacing=spacing)
+    else:
+        if work is None:
+            work = work_buffers(E.shape, E.dtype)
+        lo, hi = ((0, 0, 0), E.shape[:3]) if region is None else region
+        update_E(E, B, c, work, lo, hi, spacing)
+    if profiler is not None:
+        t = profiler.lap('curl_B', t)
 
     E[source_pos] += source_val
+    if profiler is not None:
+        t = profiler.lap('inject', t)
 
     E[metal_pos] = 0
+    if profiler is not None:
+        t = profiler.lap('metal', t)
 
-    B -= c * curl_E(E)
+    if work is None:
+        B -= c * curl_E(E, spacing=spacing)
+    else:
+        update_B(E, B, c, work, lo, hi, spacing)
+    if profiler is not None:
+        profiler.lap('curl_E', t)
 
     return E, B
 
 
+def courant_time_step(space_step, courant):
+    """
+    Largest stable time step times the Courant number
+    :param space_step: space step in m
+    :param courant: fraction of the stability limit c < 1/sqrt(3) of the 3D Yee scheme, between 0 and 1
+    :return: time step in s, renormalized speed of light c (see timestep)
+    """
+    c = courant / numpy.sqrt(3)
+    return c * space_step / constants.c, c
+
+
+class SlabTimestep:
+    """
+    Multithreaded version of timestep. The grid is split into slabs along x (the slowest varying
+    index, so that each slab is contiguous in memory) which are updated on a thread pool. All slabs
+    finish the E half step before any slab starts the B half step, so that the slabs see the updated
+    E field of their neighbours. The results are bit-identical to timestep.
+    """
+
+    def __init__(self, shape, threads=None, dtype=float, spacing=None):
+        """
+        :param shape: shape of the field arrays (x, y, z, field_component)
+        :param threads: number of threads, default is the number of CPUs
+        :param dtype: floating point type of the fields
+        :param spacing: optional per-axis spacing arrays of a graded mesh (see timestep)
+        """
+        self.spacing = spacing
+        if threads is None:
+            threads = os.cpu_count()
+        bounds = numpy.unique(numpy.linspace(0, shape[0], threads+1).astype(int))
+        self.slabs = list(zip(bounds[:-1], bounds[1:]))
+        # E needs one row of B below the slab, B needs one row of E above the slab
+        rows = max(b - a + 1 for a, b in self.slabs)
+        self.work = [work_buffers((rows,) + tuple(shape[1:]), dtype) for slab in self.slabs]
+        self.pool = concurrent.futures.ThreadPoolExecutor(len(self.slabs))
+
+    def __call__(self, E, B, c, source_pos, source_val, metal_pos, region=None, profiler=None):
+        """
+        Propagate E and B field by 1 full time step, see timestep for the parameters.
+        metal_pos must be sorted along x as returned by refine_metal. With a profiler, the injection
+        of the source and the metal are counted in curl_B, as they are applied by the same threads.
+        """
+        if profiler is not None:
+            t = profiler.clock()
+        source_pos = tuple(numpy.asarray(p) for p in source_pos)
+        source_val = numpy.broadcast_to(source_val, source_pos[0].shape)
+        lo, hi = ((0, 0, 0), E.shape[:3]) if region is None else region
+
+        def slab_region(i):
+            a, b = self.slabs[i]
+            return (max(a, lo[0]),) + tuple(lo[1:]), (min(b, hi[0]),) + tuple(hi[1:])
+
+        def slab_update_E(i):
+            a, b = self.slabs[i]
+            box = slab_region(i)
+            if box[0][0] < box[1][0]:
+                update_E(E, B, c, self.work[i], *box, self.spacing)
+
+            in_slab = (source_pos[0] >= a) & (source_pos[0] < b)
+            E[tuple(p[in_slab] for p in source_pos)] += source_val[in_slab]
+
+            start, stop = numpy.searchsorted(metal_pos[0], [a, b])
+            E[tuple(p[start:stop] for p in metal_pos)] = 0
+
+        def slab_update_B(i):
+            box = slab_region(i)
+            if box[0][0] < box[1][0]:
+                update_B(E, B, c, self.work[i], *box, self.spacing)
+
+        list(self.pool.map(slab_update_E, range(len(self.slabs))))
+        if profiler is not None:
+            t = profiler.lap('curl_B', t)
+        list(self.pool.map(slab_update_B, range(len(self.slabs))))
+        if profiler is not None:
+            profiler.lap('curl_E', t)
+        return E, B
+
+
+class CPML:
+    """
+    Convolutional perfectly matched layer absorbing the waves at the boundaries of the grid
+    (J. A. Roden and S. D. Gedney, Microwave Opt. Technol. Lett. 27, 334 (2000)).
+
+    Within thickness voxels from each face of the grid, the derivatives normal to the face in the
+    curls are replaced by d/dx + psi, where psi is a recursive convolution of d/dx with the
+    conductivity profile sigma = sigma_max * (depth/thickness)**order. As the PML terms are linear,
+    they are applied separately from the time step: update_E before and update_B after timestep.
+    """
+
+    # for each axis, the field components whose update contains a derivative along this axis:
+    # (updated component, derivated component, sign in the curl)
+    CURL_TERMS = [((1, 2, -1), (2, 1, 1)),
+                  ((0, 2, 1), (2, 0, -1)),
+                  ((0, 1, -1), (1, 0, 1))]
+
+    def __init__(self, shape, thickness, c, order=3, alpha=0.0, dtype=float):
+        """
+        :param shape: shape of the field arrays (x, y, z, field_component)
+        :param thickness: thickness of the layer in voxels
+        :param c: renormalized speed of light (see timestep)
+        :param order: order of the polynomial conductivity profile
+        :param alpha: frequency shift alpha*time_step/epsilon_0, improves the absorption of evanescent waves
+        :param dtype: floating point type of the fields
+        """
+        self.thickness = thickness
+        # optimal conductivity sigma*time_step/epsilon_0 at the outer edge of the layer
+        sigma_max = 0.8 * (order + 1) * c
+        self.layers = {'E': [], 'B': []}
+        for axis, n in enumerate(shape[:3]):
+            # E uses backward differences centered on the grid points, B forward differences
+            # centered half way between the grid points
+            for field, start, stop, offset in [('E', 1, thickness, 0.0), ('E', n-thickness, n, 0.0),
+                                               ('B', 0, thickness, 0.5), ('B', n-thickness, n-1, 0.5)]:
+                x = numpy.arange(start, stop) + offset
+                depth = numpy.maximum(thickness - x, x - (n - 1 - thickness)) / thickness
+                sigma = sigma_max * numpy.clip(depth, 0, 1)**order
+                b = numpy.exp(-(sigma + alpha))
+                a = numpy.divide(sigma * (b - 1), sigma + alpha, out=numpy.zeros_like(b), where=sigma + alpha > 0)
+                bshape = [1, 1, 1]
+                bshape[axis] = stop - start
+                region = [slice(None)] * 3
+                region[axis] = slice(start, stop)
+                shifted = [slice(None)] * 3
+                shifted[axis] = slice(start-1, stop-1) if field == 'E' else slice(start+1, stop+1)
+                rshape = list(shape[:3])
+                rshape[axis] = stop - start
+                self.layers[field].append((tuple(region), tuple(shifted), self.CURL_TERMS[axis],
+                                           b.reshape(bshape).astype(dtype), a.reshape(bshape).astype(dtype),
+                                           numpy.zeros((2,) + tuple(rshape), dtype=dtype),
+                                           numpy.empty(rshape, dtype=dtype)))
+
+    def update_E(self, E, B, c):
+        """
+        Add the PML terms of c * curl_B(B) to E
+        """
+        for region, shifted, terms, b, a, psi, tmp in self.layers['E']:
+            for (component, derivated, sign), p in zip(terms, psi):
+                numpy.subtract(B[region + (derivated,)], B[shifted + (derivated,)], out=tmp)
+                self._convolve(p, tmp, b, a, c * sign)
+                numpy.add(E[region + (component,)], tmp, out=E[region + (component,)])
+
+    def update_B(self, E, B, c):
+        """
+        Subtract the PML terms of c * curl_E(E) from B
+        """
+        for region, shifted, terms, b, a, psi, tmp in self.layers['B']:
+            for (component, derivated, sign), p in zip(terms, psi):
+                numpy.subtract(E[shifted + (derivated,)], E[region + (derivated,)], out=tmp)
+                self._convolve(p, tmp, b, a, c * sign)
+                numpy.subtract(B[region + (component,)], tmp, out=B[region + (component,)])
+
+    def state(self):
+        """
+        :return: list of the arrays containing the state of the layer (modify in place to restore)
+        """
+        return [layer[5] for field in ('E', 'B') for layer in self.layers[field]]
+
+    @staticmethod
+    def _convolve(psi, diff, b, a, factor):
+        """psi = b * psi + a * diff, then diff = factor * psi"""
+        numpy.multiply(psi, b, out=psi)
+        numpy.multiply(diff, a, out=diff)
+        numpy.add(psi, diff, out=psi)
+        numpy.multiply(psi, factor, out=diff)
+
+
 class WaveEquation:
     """
     Wrapper for live plotting. The __call__ method will be called at regular intervals
     """
 
-    def __init__(self, s, space_step, time_step, c, source, metal, center, radius, int_start,int_stop):
+    def __init__(self, s, space_step, courant, source, metal, center, radius, start, stop, threads=1,
+                 backend='numpy', dtype=numpy.float64, accumulate_dtype=numpy.float64, pml=0,
+                 sphere=None, ntff=None, active_margin=None, spacing=None, profile=False):
         """
         :param s: 3-tuple giving the shape of the grid
-        :param c: renormalized speed of light must be < 1/sqrt(3)
-        :param source: function defining the source terms. Takes the time index as input
+        :param space_step: space step in m
+        :param courant: Courant number, the time step is derived from it (see courant_time_step)
+        :param source: function defining the source terms. Takes the time in s as input
                        and returns source_pos and source_val (see timestep)
+        :param metal: boolean array of shape s, True in the metal, or metal positions as returned by
+                      refine_metal (see geometry.cached_metal)
+        :param center, radius: center (index of a grid node) and radius (in units of space_step)
+                               of the circles on which the radiation patterns are sampled
+        :param start, stop: time interval in s over which the radiation patterns are averaged
+        :param threads: number of threads used for the time steps, None for all CPUs
+        :param backend: 'numpy' (see timestep and SlabTimestep) or 'numba' (see fdtd_numba, requires numba)
+        :param dtype: floating point type of the fields, numpy.float32 halves memory and memory bandwidth
+        :param accumulate_dtype: floating point type used for the radiation patterns
+        :param pml: thickness in voxels of the absorbing layer at the boundaries (see CPML), 0 for
+                    metallic boundaries
+        :param sphere: (n_theta, n_phi) to also sample the radiation pattern on a sphere, see pattern_sphere
+        :param ntff: optional ntff.NearToFarField updated at each time step
+        :param active_margin: if given, only update the fields in the box reached by the light cone of
+                              the sources, enlarged by this margin in voxels, until the box fills the grid
+                              (see active_region). The fields beyond the margin are neglected.
+        :param spacing: optional per-axis arrays of the distances between the grid nodes in units of
+                        space_step for a graded mesh (see graded_mesh). The time step is limited by the
+                        smallest cell and the mesh must be uniform with spacing 1 in the absorbing layer.
+        :param profile: time the phases of the time steps and the plot, see the attribute profiler
+                        (profiler.Profiler) and show
         """
         s = s + (3,)
-        self.E = numpy.zeros(s)
-        self.B = numpy.zeros(s)
-        self.c = c
+        self.E = numpy.zeros(s, dtype=dtype)
+        self.B = numpy.zeros(s, dtype=dtype)
+        self.accumulate_dtype = accumulate_dtype
+        if spacing is not None:
+            spacing = [numpy.asarray(h, dtype=float) for h in spacing]
+            if [len(h) for h in spacing] != list(s[:3]):
+                raise ValueError('spacing must have the lengths %s of the grid' % (s[:3],))
+            if pml and not all(numpy.all(h[:pml+1] == 1) and numpy.all(h[-pml-2:] == 1) for h in spacing):
+                raise ValueError('the graded mesh must have spacing 1 in the absorbing layer')
+        self.spacing = spacing
+        if backend == 'numba':
+            import fdtd_numba
+            self.timestep = fdtd_numba.NumbaTimestep(s, threads, spacing)
+        elif threads == 1:
+            self.timestep = functools.partial(timestep, work=work_buffers(s, dtype), spacing=spacing)
+        else:
+            self.timestep = SlabTimestep(s, threads, dtype, spacing)
+        # the stability limit is given by the smallest cell
+        self.min_spacing = 1 if spacing is None else min(numpy.min(h) for h in spacing)
+        self.time_step, c = courant_time_step(space_step * self.min_spacing, courant)
+        self.c = c * self.min_spacing
+        # positions of the grid nodes in units of space_step
+        if spacing is None:
+            self.nodes = [numpy.arange(n) for n in s[:3]]
+        else:
+            self.nodes = [grid_nodes(h) for h in spacing]
+        self.pml = CPML(s, pml, self.c, dtype=dtype) if pml else None
+        self.ntff = ntff
         self.source = source
         self.index = 0
-        self.metal = refine_metal(metal)
+        self.active_margin = active_margin
+        self.source_box = None
+        self.profiler = profiler.Profiler() if profile else None
+        self.metal = tuple(metal) if isinstance(metal, (tuple, list)) else geometry.refine(metal)
         self.space_step = space_step
-        self.time_step = time_step
         self.center = center
-        self.int_start = int_start
-        self.int_stop = int_stop
+        # time indices of the interval over which the radiation patterns are averaged
+        self.int_start = int(round(start / self.time_step))
+        self.int_stop = self.int_start + max(1, int(round((stop - start) / self.time_step)))
         self.phi = numpy.linspace(0,2*numpy.pi,200)
-        self.cp = numpy.round(numpy.cos(self.phi)*radius).astype(int)
-        self.sp = numpy.round(numpy.sin(self.phi)*radius).astype(int)
-        self.z = numpy.zeros(self.phi.shape,dtype=int)
-        self.pattern_xy = 0
-        self.pattern_yz = 0
-        self.pattern_xz = 0
+        cp = numpy.cos(self.phi)*radius
+        sp = numpy.sin(self.phi)*radius
+        z = numpy.zeros(self.phi.shape)
+        # sample points of the radiation patterns relative to the center: XY, YZ and XZ planes
+        points = [numpy.transpose([cp,sp,z]), numpy.transpose([z,cp,sp]), numpy.transpose([cp,z,sp])]
+        if sphere is not None:
+            self.theta = numpy.linspace(0, numpy.pi, sphere[0])
+            self.sphere_phi = numpy.linspace(0, 2*numpy.pi, sphere[1], endpoint=False)
+            theta, phi = numpy.meshgrid(self.theta, self.sphere_phi, indexing='ij')
+            direction = numpy.stack([numpy.sin(theta)*numpy.cos(phi), numpy.sin(theta)*numpy.sin(phi),
+                                     numpy.cos(theta)], axis=-1)
+            points.append(direction.reshape(-1,3)*radius)
+        points = numpy.concatenate(points)
+        if spacing is None:
+            points = numpy.round(points).astype(int)
+            index = points + center
+        else:
+            # nearest grid nodes, and their actual positions relative to the center
+            index = numpy.transpose([numpy.searchsorted(0.5*(x[1:] + x[:-1]), p + x[i])
+                                     for x, p, i in zip(self.nodes, numpy.transpose(points), center)])
+            points = numpy.transpose([x[i] - x[m] for x, i, m in zip(self.nodes, numpy.transpose(index), center)])
+        # flat indices of the sample points in E.reshape(-1,3) and weights to obtain the radial Poynting
+        # vector multiplied by the square of the distance
+        self.pattern_index = numpy.ravel_multi_index(tuple(numpy.transpose(index)), s[:3])
+        self.pattern_weight = (points * numpy.sqrt(numpy.sum(points**2, axis=-1))[:,None]).astype(accumulate_dtype)
+        self.pattern_samples = numpy.empty((2, len(points), 3), dtype=dtype)
+        self.pattern = numpy.zeros(len(points), dtype=accumulate_dtype)
         self.npattern = 0
+        self.patterns_complete = False
+        self.plot_key = None
 
 
+    def _state(self):
+        """
+        :return: dictionary of the arrays besides E and B containing the state of the simulation
+        """
+        state = {'pattern': self.pattern}
+        if self.pml is not None:
+            state.update(('pml_%d' % i, a) for i, a in enumerate(self.pml.state()))
+        if self.ntff is not None:
+            state.update(('ntff_%d' % i, a) for i, a in enumerate(self.ntff.state()))
+        return state
+
+    def save_checkpoint(self, directory):
+        """
+        Save the state of the simulation to directory as E.npy, B.npy and state.npz. Each save writes
+        the whole fields: they are written to temporary files first and then renamed, state.npz last,
+        so that an interrupted save leaves the previous checkpoint readable.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in ('E', 'B'):
+            field = getattr(self, name)
+            if isinstance(field, numpy.memmap) and field.filename is not None and \
+                    os.path.abspath(field.filename) == os.path.abspath(os.path.join(directory, name + '.npy')):
+                # resumed from this checkpoint, the mapped file is about to be replaced
+                setattr(self, name, numpy.array(field))
+        temporary = []
+        try:
+            for name in ('E', 'B'):
+                f, filename = tempfile.mkstemp(dir=directory, suffix='.npy')
+                temporary.append(filename)
+                with os.fdopen(f, 'wb') as f:
+                    numpy.save(f, getattr(self, name))
+            f, filename = tempfile.mkstemp(dir=directory, suffix='.npz')
+            temporary.append(filename)
+            with os.fdopen(f, 'wb') as f:
+                numpy.savez(f, index=self.index, npattern=self.npattern, **self._state())
+            for filename, name in zip(temporary, ('E.npy', 'B.npy', 'state.npz')):
+                os.replace(filename, os.path.join(directory, name))
+        finally:
+            for filename in temporary:
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    def load_checkpoint(self, directory):
+        """
+        Resume the simulation from a checkpoint saved by save_checkpoint. The WaveEquation must have been
+        created with the same parameters. E and B are copy-on-write memory maps of the checkpoint files:
+        the pages are read when first used and the time steps never write to the files, so that several
+        simulations can start from the same checkpoint.
+        """
+        for name in ('E', 'B'):
+            field = numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='c')
+            if field.shape != getattr(self, name).shape:
+                raise ValueError('checkpoint %s has shape %s instead of %s' % (name, field.shape, getattr(self, name).shape))
+            if field.dtype != getattr(self, name).dtype:
+                raise ValueError('checkpoint %s has type %s instead of %s' % (name, field.dtype, getattr(self, name).dtype))
+            setattr(self, name, field)
+        with numpy.load(os.path.join(directory, 'state.npz')) as saved:
+            self.index = int(saved['index'])
+            self.npattern = int(saved['npattern'])
+            for name, array in self._state().items():
+                array[...] = saved[name]
+        # the fields of the checkpoint can be anywhere in the grid
+        self.active_margin = None
+
     def injected_power(self, source_pos, source_val):
         return numpy.sum(2*self.E[source_pos]*source_val + source_val**2)
         
+    @property
+    def pattern_xy(self):
+        return self.pattern[:len(self.phi)]
+
+    @property
+    def pattern_yz(self):
+        return self.pattern[len(self.phi):2*len(self.phi)]
+
+    @property
+    def pattern_xz(self):
+        return self.pattern[2*len(self.phi):3*len(self.phi)]
+
+    @property
+    def pattern_sphere(self):
+        """radiation pattern on the sphere, indices (theta, phi), or None"""
+        if len(self.pattern) == 3*len(self.phi):
+            return None
+        return self.pattern[3*len(self.phi):].reshape(len(self.theta), len(self.sphere_phi))
+
     def update_radiation_pattern(self):
-        def pattern(x,y,z):
-            return numpy.sum(poynting(self.E[self.center[0]+x, self.center[1]+y, self.center[2]+z],
-                                   self.B[self.center[0]+x, self.center[1]+y, self.center[2]+z])*
-                             numpy.transpose([x,y,z]),axis=-1)*numpy.sqrt(x**2+y**2+z**2)
-            
-        self.pattern_xy = self.pattern_xy + pattern(self.cp,self.sp,self.z)
-        self.pattern_yz = self.pattern_yz + pattern(self.z,self.cp,self.sp)
-        self.pattern_xz = self.pattern_xz + pattern(self.cp,self.z,self.sp)
+        E, B = self.pattern_samples
+        numpy.take(self.E.reshape(-1,3), self.pattern_index, axis=0, out=E)
+        numpy.take(self.B.reshape(-1,3), self.pattern_index, axis=0, out=B)
+        self.pattern += numpy.sum(poynting(E, B, self.accumulate_dtype)*self.pattern_weight, axis=-1)
         self.npattern += 1
 
-    def plot_radiation_patterns(self):
+    def plot_radiation_patterns(self, directory=None):
+        """
+        Plot the accumulated radiation patterns
+        :param directory: if given, save the patterns as png images and as radiation_patterns.npz
+                          in this directory instead of showing them
+        """
         pmax = 10*numpy.log10(numpy.max([numpy.max(self.pattern_xy),numpy.max(self.pattern_yz),numpy.max(self.pattern_xz)])/self.npattern)
         
         def plot_radiation_pattern(pattern, name):
-            fig = matplotlib.pyplot.figure()
+            if directory is None:
+                fig = matplotlib.pyplot.figure()
+            else:
+                fig = matplotlib.figure.Figure()
             ax = fig.add_subplot(projection='polar')
             ax.set_title(name)
             ax.plot(self.phi,10*numpy.log10(pattern/self.npattern))
             ax.set_ylim(pmax-35,pmax+5)
+            if directory is not None:
+                fig.savefig(os.path.join(directory, name.replace(' ', '_').lower() + '.png'))
 
         plot_radiation_pattern(self.pattern_xy,"Plan XY")
         plot_radiation_pattern(self.pattern_yz,"Plan YZ")
         plot_radiation_pattern(self.pattern_xz,"Plan XZ")
-        matplotlib.pyplot.show()
-        
-        
-        
-        
+        if directory is None:
+            matplotlib.pyplot.show()
+        else:
+            patterns = dict(phi=self.phi, xy=self.pattern_xy/self.npattern, yz=self.pattern_yz/self.npattern,
+                            xz=self.pattern_xz/self.npattern)
+            if self.pattern_sphere is not None:
+                patterns.update(theta=self.theta, sphere_phi=self.sphere_phi, sphere=self.pattern_sphere/self.npattern)
+            numpy.savez(os.path.join(directory, 'radiation_patterns.npz'), **patterns)
+
+    def active_region(self, source_pos):
+        """
+        Box (lo, hi) outside of which the fields are still 0: the bounding box of the sources enlarged
+        by the distance travelled by light since the first source term and by active_margin
+        (the stencil spreads by one voxel per time step, but all but a negligible part of the fields
+        travels at c). Returns None once the box fills the grid, after which the whole grid is updated.
+        :param source_pos: source positions of the current time step (see timestep)
+        """
+        if self.active_margin is None:
+            return None
+        lo = numpy.array([numpy.min(p) for p in source_pos[:3]])
+        hi = numpy.array([numpy.max(p) for p in source_pos[:3]]) + 1
+        if self.source_box is None:
+            self.source_box = (lo, hi, self.index)
+        else:
+            self.source_box = (numpy.minimum(self.source_box[0], lo), numpy.maximum(self.source_box[1], hi),
+                               self.source_box[2])
+        lo, hi, start = self.source_box
+        # distance in voxels, the fine voxels of a graded mesh are crossed faster
+        reach = int(numpy.ceil(self.c / self.min_spacing * (self.index - start + 1))) + self.active_margin
+        shape = self.E.shape[:3]
+        lo = numpy.maximum(lo - reach, 0)
+        hi = numpy.minimum(hi + reach, shape)
+        if numpy.all(lo == 0) and numpy.all(hi == shape):
+            self.active_margin = None
+            return None
+        return tuple(lo), tuple(hi)
+
+    def step(self):
+        """
+        Perform one time step and cumulate the radiation patterns
+        :return: True if the radiation patterns have just been completed
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            t = profiler.clock()
+        source_pos, source_val = self.source(self.index * self.time_step)
+        if profiler is not None:
+            t = profiler.lap('source_eval', t)
+        if self.pml is not None:
+            self.pml.update_E(self.E, self.B, self.c)
+        if profiler is not None:
+            t = profiler.lap('pml', t)
+        self.E, self.B = self.timestep(self.E, self.B, self.c, source_pos, source_val, self.metal,
+                                       region=self.active_region(source_pos), profiler=profiler)
+        if profiler is not None:
+            t = profiler.clock()
+        if self.pml is not None:
+            self.pml.update_B(self.E, self.B, self.c)
+        if profiler is not None:
+            t = profiler.lap('pml', t)
+
+        # cumulate averages for radiation patterns
+        done = False
+        if self.index >= self.int_start and self.index < self.int_stop:
+            self.update_radiation_pattern()
+            done = self.index+1 >= self.int_stop
+        self.index += 1
+        if profiler is not None:
+            t = profiler.lap('radiation', t)
+        if self.ntff is not None:
+            self.ntff.update(self.E, self.B, self.index)
+        if profiler is not None:
+            profiler.lap('ntff', t)
+            profiler.step()
+        return done
+
+    def run(self, n_steps, snapshot_interval=0, snapshot=None, checkpoint_interval=0, checkpoint_directory=None,
+            recorder=None):
+        """
+        Perform n_steps time steps without plotting
+        :param n_steps: number of time steps
+        :param snapshot_interval: number of time steps between calls of snapshot, 0 for never
+        :param snapshot: function called with the WaveEquation as argument every snapshot_interval steps
+        :param checkpoint_interval: number of time steps between checkpoints, 0 for never
+        :param checkpoint_directory: directory of the checkpoints (see save_checkpoint)
+        :param recorder: optional recorder.Recorder recording the fields after each time step
+        """
+        for i in range(n_steps):
+            self.step()
+            if recorder is not None:
+                recorder.record(self)
+            if snapshot is not None and snapshot_interval and self.index % snapshot_interval == 0:
+                snapshot(self)
+            if checkpoint_directory is not None and checkpoint_interval and self.index % checkpoint_interval == 0:
+                self.save_checkpoint(checkpoint_directory)
 
     def __call__(self, figure, field, component, slice, slice_index, initial=False):
         """
-        Perform one time step and plot selected field component
+        Perform one time step and plot selected field component, show radiation patterns when ready
+        (see plot for the parameters)
+        """
+        self.compute()
+        return self.show(figure, field, component, slice, slice_index, initial)
+
+    def compute(self):
+        """
+        Perform one time step, the radiation patterns are shown by the next call of show. Used as
+        compute_func of fiddle.FiddlePlotter, which calls it in a worker thread.
+        """
+        if self.step():
+            self.patterns_complete = True
+
+    def show(self, figure, field, component, slice, slice_index, initial=False):
+        """
+        Plot selected field component and show the radiation patterns once completed by compute
+        (see plot for the parameters). With profile, the title also shows the step rate, the peak
+        memory and the share of each phase.
+        """
+        if self.profiler is not None:
+            t = self.profiler.clock()
+        if self.patterns_complete:
+            self.patterns_complete = False
+            self.plot_radiation_patterns()
+        artists = self.plot(figure, field, component, slice, slice_index, initial)
+        if self.profiler is not None:
+            self.profiler.lap('plot', t)
+            self.axes.set_title(self.axes.get_title() + '\n' + self.profiler.title(), fontsize='small')
+        return artists
+
+    def plot(self, figure, field, component, slice, slice_index, initial=False):
+        """
+        Plot selected field component
         :param figure: figure object on which to plot
         :param field_component: field component to plot:
         0->Ex, 1->Ey, 2->Ez, 3->Bx 4->By, 5->Bz, 6->Sx, 7->Sy, 8->Sy, 9: Metal
         :param slice: coordinate that will be fixed for 2d plotting 0->x, 1->y, 2->z
         :param slice_index: value of the fixed coordiante
         :param initial: boolean, True if the plot needs to be initialized
-        :return:
+        :return: the artists changing from one frame to the next (image and title)
         """
-        #update fields
-        
-        source_pos, source_index = source(self.index)
-        self.E, self.B = timestep(self.E, self.B, self.c, source_pos, source_index, self.metal)
-
-        # cumulate averages for radiation patterns and show radiation patterns when ready
-        
-        if self.index >= self.int_start and self.index < self.int_stop:
-            self.update_radiation_pattern()
-            if self.index+1 >= self.int_stop:
-                self.plot_radiation_patterns()
-
-        #update plots
-        
-        self.index += 1
+        # only the displayed slice is used, so that a frame costs O(n^2)
+        region = [numpy.s_[:]] * 3
+        region[slice] = slice_index
+        region = tuple(region)
         lims=1
         if field == EFIELD:
-            toplot = self.E
+            toplot = self.E[region]
             lims = 1e-3
         elif field == BFIELD:
-            toplot = self.B
+            toplot = self.B[region]
             lims = 1e-3
         elif field == ENERGY_DENSITY:
-            toplot = 0.5*(numpy.sum(self.E**2,axis=-1) + numpy.sum(self.B**2,axis=-1))
+            E = self.E[region]
+            B = self.B[region]
+            toplot = 0.5*(numpy.sum(E**2,axis=-1) + numpy.sum(B**2,axis=-1))
             lims = 1e-7
         elif field == POYNTING:
             lims = 1e-2
-            toplot = poynting(self.E, self.B)
+            toplot = poynting(self.E[region], self.B[region])
 
         elif field == METAL:
-            toplot = numpy.zeros(self.E.shape)
+            toplot = numpy.zeros(self.E[region].shape)
             lims = 1
-            toplot[self.metal] = 1
-            
-        if slice == 0:
-            toplot = toplot[slice_index, :, :]
-            labels = 'yz'
-        elif slice == 1:
-            toplot = toplot[:, slice_index, :]
-            labels = 'xz'
-        elif slice == 2:
-            toplot = toplot[:, :, slice_index]
-            labels = 'xy'
+            in_slice = self.metal[slice] == slice_index
+            toplot[tuple(p[in_slice] for i, p in enumerate(self.metal) if i != slice)] = 1
+
+        labels = {0: 'yz', 1: 'xz', 2: 'xy'}[slice]
         is_vector_field = len(toplot.shape)==3
         if is_vector_field:
             if component < 3:
@@ -237,32 +849,49 @@ class WaveEquation:
                 toplot = numpy.sqrt(numpy.sum(toplot**2,axis=-1))
         # imshow expects y coordinate first
         toplot = toplot.transpose()
-        if is_vector_field:
-            norm = matplotlib.colors.CenteredNorm(halfrange=lims)
-            cmap = matplotlib.cm.bwr
-        else:
-            cmap = matplotlib.cm.cividis
-            if component == DECIBEL:
-                norm = matplotlib.colors.LogNorm(vmin=lims*1e-3,vmax=10*lims)
+        # the norm and the colormap only change with the dropdown menus
+        key = (field, component, slice)
+        if initial or key != self.plot_key:
+            self.plot_key = key
+            if is_vector_field:
+                self.norm = matplotlib.colors.CenteredNorm(halfrange=lims)
+                self.cmap = matplotlib.cm.bwr
+            else:
+                self.cmap = matplotlib.cm.cividis
+                if component == DECIBEL:
+                    self.norm = matplotlib.colors.LogNorm(vmin=lims*1e-3,vmax=10*lims)
+                else:
+                    self.norm = matplotlib.colors.Normalize(vmin=0,vmax=lims)
+            # the cells of a graded mesh have different sizes, the image is drawn on the cell boundaries
+            self.edges = [cell_edges(self.nodes[i]) * self.space_step for i in range(3) if i != slice]
+            if initial:
+                self.axes = figure.add_subplot(111)
+                self.axes.set_aspect('equal')
             else:
-                norm = matplotlib.colors.Normalize(vmin=0,vmax=lims)
-        if initial:
-            self.axes = figure.add_subplot(111)
-            self.image = self.axes.imshow(norm(toplot),norm=None, vmin=0,vmax=1, cmap=cmap,
-                                          extent=(-0.5*self.space_step,
-                                                  (toplot.shape[0]-0.5)*self.space_step,
-                                                  -0.5*self.space_step,
-                                                  (toplot.shape[1]-0.5)*self.space_step),
-                                          origin='lower')
+                self.image.remove()
+            self.image = matplotlib.image.PcolorImage(self.axes, *self.edges, self.norm(toplot), cmap=self.cmap,
+                                                      norm=matplotlib.colors.Normalize(vmin=0, vmax=1))
+            self.axes.add_image(self.image)
+            self.axes.set_xlim(self.edges[0][0], self.edges[0][-1])
+            self.axes.set_ylim(self.edges[1][0], self.edges[1][-1])
+            self.axes.set_xlabel(labels[0] + ' (m)')
+            self.axes.set_ylabel(labels[1] + ' (m)')
         else:
-            self.image.set_data(norm(toplot))
-            self.image.set_cmap(cmap)
-        self.axes.set_xlabel(labels[0] + ' (m)')
-        self.axes.set_ylabel(labels[1] + ' (m)')
+            self.image.set_data(*self.edges, self.norm(toplot))
         self.axes.set_title('index %d t = %.0f ps' % (self.index, self.time_step * self.index*1e12))
+        return [self.image, self.axes.title]
         
 
-def cantenna(grid_dim, base, rmin, height, thickness):
+def cantenna_shape(base, rmin, height, thickness):
+    """
+    Cantenna as a geometry.Shape, same parameters as cantenna
+    """
+    wall = geometry.Cylinder(base[:2], rmin+thickness, base[2], base[2] + height, inner=rmin)
+    bottom = geometry.Cylinder(base[:2], rmin+thickness, base[2]-thickness, base[2])
+    return wall | bottom
+
+
+def cantenna(grid_dim, base, rmin, height, thickness, nodes=None):
     """
     Draw a cantenna
     :param grid_dim: 3-tuple defining the dimensions of the grid
@@ -270,76 +899,200 @@ def cantenna(grid_dim, base, rmin, height, thickness):
     :rmin: internal radius of the can (in voxels)
     :height: internal height of the can (in voxels)
     :thickness: wall thicknes of the can (in voxels)
+    :nodes: positions of the grid nodes along each axis for a graded mesh (see grid_nodes), the
+            other lengths are then in units of space_step
     """
-    x = numpy.arange(grid_dim[0])
-    y = numpy.arange(grid_dim[1])
-    z = numpy.arange(grid_dim[2])
-    r = numpy.sqrt((x[:,None]-base[0])**2+(y[None,:]-base[1])**2)
-    cylinder = ((r >= rmin) & (r <= (rmin+thickness)))[:,:,None] & ((z <= base[2] + height) & (z >= base[2]))[None,None,:]
-    bottom = (r <= (rmin+thickness))[:,:,None] & ((z <= base[2]) & (z >= base[2]-thickness))[None,None,:]
-    return cylinder | bottom
+    return geometry.rasterize(cantenna_shape(base, rmin, height, thickness), grid_dim, nodes)
 
 
-    
-    
-
-
-if __name__ == "__main__":
-    put_cantenna=True                           # put cantenna around dipole antenna or not
-    n = 100                                     # grid size n x n x n
-    f = 2.4e9                                   # source frequency
-    time_step = 1.0/f/80                        # time step in s
-    c = 0.1                                     # renormalized speed of light in voxel/iteration, must be < 1/sqrt(3)
-    space_step = constants.c * time_step / c
-    cantenna_radius = 0.095/2 / space_step
-    cantenna_height = 0.133 / space_step
-    antenna_from_bottom = 0.06 / space_step
-    cantenna_thickness = 3                      # make walls at least 3 voxels thick, otherwise there might be discretization problems making the can leaky
+def dipole_simulation(put_cantenna=True, n=100, f=2.4e9, far_field=False, can_radius=0.095/2, can_height=0.133,
+                      feed_height=0.06, courant=0.1*numpy.sqrt(3), graded=None, geometry_cache=None, **kwargs):
+    """
+    Set up the simulation of a dipole antenna with or without cantenna
+    :param put_cantenna: put cantenna around dipole antenna or not
+    :param n: grid size n x n x n
+    :param f: source frequency
+    :param can_radius: internal radius of the can in m
+    :param can_height: internal height of the can in m
+    :param feed_height: distance of the dipole from the bottom of the can in m
+    :param far_field: calculate the 3D far field with a near to far field transformation (see ntff)
+    :param courant: Courant number (see courant_time_step), the default corresponds to c = 0.1. Up to
+                    about 0.99 the same physical time is reached in fewer steps.
+    :param graded: if given, use a graded mesh (see graded_mesh) with this fraction of the space step
+                   around the can and the dipole. n is then the size of the grid in coarse voxels and
+                   the walls are 3 fine voxels thick.
+    :param geometry_cache: directory in which the metal positions are cached (see geometry.cached_metal)
+    :param kwargs: further arguments of WaveEquation (threads, backend, ...)
+    :return: WaveEquation, run until int_stop to obtain the radiation patterns
+    """
+    space_step = constants.c / f / 8            # space step in m, 8 voxels per wavelength
+    fine = 1 if graded is None else graded
+    time_step, c = courant_time_step(space_step * fine, courant)
+    c = c * fine
+    cantenna_radius = can_radius / space_step
+    cantenna_height = can_height / space_step
+    antenna_from_bottom = feed_height / space_step
+    cantenna_thickness = 3 * fine               # make walls at least 3 voxels thick, otherwise there might be discretization problems making the can leaky
     cantenna_bottom =  n//2 - cantenna_height
-    # excitation current. 0.00306 produces radiation pattern approximately calibrated to dBi. 
-    current_ampl = 0.00306
+    # excitation current. 0.00306 produces radiation pattern approximately calibrated to dBi for c = 0.1.
+    # The renormalized fields scale as 1/time_step, so the current is scaled with the time step.
+    current_ampl = 0.00306 * c / 0.1
     if put_cantenna:
-        radiation_diagram_start = 600
-        source_pos = int(cantenna_bottom + antenna_from_bottom)
+        radiation_diagram_start = 7.5/f         # in s, once the steady state is reached
+        source_z = cantenna_bottom + antenna_from_bottom
     else:
-        radiation_diagram_start = 400
-        source_pos = n//2
-    radiation_diagram_center = [n//2,n//2,n//2]
+        radiation_diagram_start = 5/f
+        source_z = n//2
     radiation_diagram_radius = 0.25*n
 
-    radiation_diagram_stop = radiation_diagram_start + 1./f/time_step
-    
+    radiation_diagram_stop = radiation_diagram_start + 1./f
 
-    def source(index):
+    if graded is None:
+        spacing = None
+        nodes = [numpy.arange(n)] * 3
+        # size of the space grid
+        dims = (n,n,n)
+    else:
+        # fine mesh around the can (or the dipole) and its walls, coarse elsewhere
+        margin = cantenna_thickness + 1
+        if put_cantenna:
+            lateral = (n//2 - cantenna_radius - margin, n//2 + cantenna_radius + margin)
+            vertical = (cantenna_bottom - margin, cantenna_bottom + cantenna_height + 1)
+        else:
+            lateral = vertical = (n//2 - margin, n//2 + margin)
+        spacing = [graded_mesh(n, [lateral], fine), graded_mesh(n, [lateral], fine), graded_mesh(n, [vertical], fine)]
+        nodes = [grid_nodes(h) for h in spacing]
+        dims = tuple(len(h) for h in spacing)
+        kwargs['spacing'] = spacing
+    # grid nodes closest to the center of the grid and to the dipole
+    center = [int(numpy.argmin(numpy.abs(x - n//2))) for x in nodes]
+    source_pos = int(numpy.argmin(numpy.abs(nodes[2] - int(source_z))))
+    if graded is not None:
+        # keep the dipole moment of a coarse voxel
+        current_ampl /= spacing[0][center[0]] * spacing[1][center[1]] * spacing[2][source_pos]
+    radiation_diagram_center = center
+
+    def source(t):
         """
         source term of electric field (current)
-        :param index: time step number
+        :param t: time in s
         :return: source_pos, source_val
         source_pos: coordinates of sources
         source_val: corresponding current values
         """
         #return current source in x direction (last index=0) at coordinates (50,50,20)
-        return ([n//2], [n//2], [source_pos], [0]), current_ampl*numpy.sin(2*numpy.pi*f*time_step * index)
-    
-    # size of the space grid
-    dims = (n,n,n)
+        return ([center[0]], [center[1]], [source_pos], [0]), current_ampl*numpy.sin(2*numpy.pi*f*t)
+
+    if far_field:
+        # Huygens box just inside the absorbing boundary layer
+        margin = kwargs.get('pml', 0) + 2
+        kwargs['ntff'] = ntff.NearToFarField((margin,)*3, tuple(d-1-margin for d in dims), f, space_step, time_step, c,
+                                             int(round(radiation_diagram_start / time_step)),
+                                             int(round(radiation_diagram_stop / time_step)),
+                                             None if graded is None else nodes)
     
     if put_cantenna:
         # simulation with cantenna
-        w = WaveEquation(dims, space_step, time_step, c, source,
-                         cantenna(dims, (n//2,n//2,cantenna_bottom),cantenna_radius,
-                                  cantenna_height,cantenna_thickness),
+        can = cantenna_shape((n//2,n//2,cantenna_bottom),cantenna_radius,cantenna_height,cantenna_thickness)
+        w = WaveEquation(dims, space_step, courant, source,
+                         geometry.cached_metal(can, dims, None if graded is None else nodes, geometry_cache),
                          radiation_diagram_center,radiation_diagram_radius,
-                         radiation_diagram_start,radiation_diagram_stop)
+                         radiation_diagram_start,radiation_diagram_stop,
+                         **kwargs)
     else:
         # simulation without metal objects
-        w = WaveEquation(dims, space_step, time_step, c, source, numpy.zeros(dims,dtype=bool),
+        w = WaveEquation(dims, space_step, courant, source, numpy.zeros(dims,dtype=bool),
                          radiation_diagram_center, radiation_diagram_radius,
-                         radiation_diagram_start,radiation_diagram_stop)
+                         radiation_diagram_start,radiation_diagram_stop,
+                         **kwargs)
+    return w
 
-    fiddle.fiddle(w, [('field',{'E':EFIELD,'B':BFIELD,'Energy density':ENERGY_DENSITY, 'Poynting':POYNTING, 'Metal':METAL},'E'),
-                       ('component',{'X':0, 'Y':1, 'Z':2,'norm':NORM,'dB':DECIBEL},'norm'),
-                      ('slice',{'XY':2,'YZ':0,'XZ':1},'XZ'),
-                      ('slice index',0,n-1,n//2,1)], update_interval=0.01)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Finite difference simulation of a dipole antenna in a cantenna')
+    parser.add_argument('--headless', action='store_true',
+                        help='run without user interface and save the radiation patterns instead of showing them')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='number of time steps in headless mode (default: until the radiation patterns are complete)')
+    parser.add_argument('--snapshot-interval', type=int, default=0,
+                        help='save an image of the E field every SNAPSHOT_INTERVAL steps in headless mode')
+    parser.add_argument('--output', default='.', help='output directory in headless mode')
+    parser.add_argument('--threads', type=int, default=1, help='number of threads used for the simulation')
+    parser.add_argument('--backend', choices=['numpy', 'numba'], default='numpy',
+                        help='implementation of the time step, numba requires the numba package')
+    parser.add_argument('--pml', type=int, default=0,
+                        help='thickness in voxels of the absorbing boundary layer, 0 for metallic boundaries')
+    parser.add_argument('--far-field', action='store_true',
+                        help='calculate the 3D directivity with a near to far field transformation (headless mode)')
+    parser.add_argument('--checkpoint', default=None,
+                        help='directory in which the state is saved every CHECKPOINT_INTERVAL steps in headless mode')
+    parser.add_argument('--checkpoint-interval', type=int, default=1000, help='number of steps between checkpoints')
+    parser.add_argument('--resume', default=None, help='directory of a checkpoint from which the simulation is resumed')
+    parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64',
+                        help='floating point type of the fields, float32 halves the memory')
+    parser.add_argument('--courant', type=float, default=0.1*numpy.sqrt(3),
+                        help='Courant number, fraction of the largest stable time step (up to about 0.99)')
+    parser.add_argument('--record', default=None,
+                        help='directory in which the E and B fields are recorded in headless mode (see recorder.py)')
+    parser.add_argument('--record-interval', type=int, default=10, help='number of time steps between recorded frames')
+    parser.add_argument('--record-decimation', type=int, default=2,
+                        help='record every RECORD_DECIMATION-th voxel along each axis')
+    parser.add_argument('--compress', action='store_true', help='compress the recording')
+    parser.add_argument('--fps', type=float, default=25,
+                        help='frames per second of the user interface, the simulation runs in between')
+    parser.add_argument('--graded', type=float, default=None,
+                        help='graded mesh with cells of GRADED times the space step around the can (e.g. 0.25)')
+    parser.add_argument('--active-margin', type=int, default=None,
+                        help='only update the region reached by the wave, enlarged by ACTIVE_MARGIN voxels (e.g. 16)')
+    parser.add_argument('--profile', nargs='?', const='', default=None,
+                        help='time the phases of the time steps, the plot and its drawing, show the result in the title and '
+                             'save it at the end in the file PROFILE (.json or .csv) if given')
+    args = parser.parse_args()
+
+    n = 100
+    w = dipole_simulation(True, n, far_field=args.far_field, threads=args.threads, backend=args.backend, dtype=numpy.dtype(args.dtype),
+                          pml=args.pml, active_margin=args.active_margin, courant=args.courant,
+                          graded=args.graded, profile=args.profile is not None)
+    if args.resume is not None:
+        w.load_checkpoint(args.resume)
 
+    if args.headless:
+        os.makedirs(args.output, exist_ok=True)
+
+        def snapshot(w):
+            figure = matplotlib.figure.Figure()
+            w.plot(figure, EFIELD, NORM, 1, w.E.shape[1]//2, initial=True)
+            figure.savefig(os.path.join(args.output, 'snapshot_%06d.png' % w.index))
+
+        recording = None
+        if args.record is not None:
+            import recorder
+            recording = recorder.Recorder(args.record, compress=args.compress)
+            for field in recorder.FIELDS:
+                recording.add_volume(w, field, field, args.record_decimation, args.record_interval)
+
+        n_steps = int(numpy.ceil(w.int_stop)) - w.index if args.steps is None else args.steps
+        try:
+            w.run(n_steps, args.snapshot_interval, snapshot, args.checkpoint_interval, args.checkpoint, recording)
+        finally:
+            # also write the frames recorded before an interruption
+            if recording is not None:
+                recording.close()
+        if args.checkpoint is not None:
+            w.save_checkpoint(args.checkpoint)
+        if w.npattern:
+            w.plot_radiation_patterns(args.output)
+        if w.ntff is not None and w.ntff.samples:
+            w.ntff.save(os.path.join(args.output, 'far_field.npz'))
+        if w.profiler is not None:
+            print(w.profiler.title())
+    else:
+        import fiddle
+        fiddle.fiddle(w.show, [('field',{'E':EFIELD,'B':BFIELD,'Energy density':ENERGY_DENSITY, 'Poynting':POYNTING, 'Metal':METAL},'E'),
+                           ('component',{'X':0, 'Y':1, 'Z':2,'norm':NORM,'dB':DECIBEL},'norm'),
+                          ('slice',{'XY':2,'YZ':0,'XZ':1},'XZ'),
+                          ('slice index',0,lambda field, component, slice, index: w.E.shape[slice]-1,
+                           w.E.shape[1]//2,1)],
+                      compute_func=w.compute, fps=args.fps, profiler=w.profiler)
+    if args.profile:
+        w.profiler.save(args.profile)
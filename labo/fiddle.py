@@ -1,7 +1,7 @@
 
 #  Copyright (C) 2009,2011,2020. Max Hofheinz
 
-import tkinter
+import tkinter, threading, blitting
 
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure
@@ -29,6 +29,10 @@ class Param(tkinter.Frame):
 class ParamFiddle(Param):
     def __init__(self, parent, callback, param_index, param_name, v_min, v_max, v_start=None, resolution=-1):
         Param.__init__(self, parent, callback, param_index, param_name)
+        # a function of the parameter values sets the maximum in update_range
+        self.v_max_func = v_max if callable(v_max) else None
+        if self.v_max_func is not None:
+            v_max = v_start
         self.v_min = v_min
         self.v_max = v_max
         self.last_value = 0.5 * (v_min + v_max) if v_start is None else v_start
@@ -41,6 +45,17 @@ class ParamFiddle(Param):
     def get_value(self):
         return self.scale.get()
 
+    def update_range(self, values):
+        """
+        Set the maximum to v_max(*values) if v_max is a function, and move the slider into the range
+        """
+        if self.v_max_func is None:
+            return
+        self.v_max = self.v_max_func(*values)
+        self.scale.configure(to=self.v_max)
+        if self.scale.get() > self.v_max:
+            self.scale.set(self.v_max)
+
 
 
 class ParamDropdown(Param):
@@ -62,7 +77,24 @@ class ParamDropdown(Param):
 
 
 class FiddlePlotter(tkinter.Frame):
-    def __init__(self, parent, plot_func, parameters, update_interval=False):
+    def __init__(self, parent, plot_func, parameters, update_interval=False, compute_func=None, fps=25,
+                 profiler=None):
+        """
+        :param plot_func: called with (figure, *parameter values, initial) to update the figure. If it
+                          returns a list of artists, only these artists are redrawn (blitting) until
+                          a parameter changes or the figure is resized.
+        :param parameters: list of parameter definitions, (name, entries dict, default) for a dropdown
+                           menu, (name, min, max, start, resolution) for a slider. max can be a function
+                           of the parameter values, e.g. the size of the axis chosen by a dropdown menu.
+        :param update_interval: interval in s between calls of plot_func, False for updating only when
+                                a parameter changes. Ignored with compute_func.
+        :param compute_func: optional function called repeatedly without arguments in a worker thread
+                             (e.g. one simulation step). The latest state is then plotted fps times
+                             per second and the intermediate states are not shown.
+        :param fps: number of frames per second with compute_func
+        :param profiler: optional profiler.Profiler, the drawing of the figure on the canvas (complete or
+                         blitted) is then timed as the phase draw
+        """
         tkinter.Frame.__init__(self, parent)
         self.parameters = parameters
         self.plot_func = plot_func
@@ -80,37 +112,91 @@ class FiddlePlotter(tkinter.Frame):
         for p in self.paramControls:
             p.pack(side=tkinter.TOP, fill=tkinter.X)
 
-        self.param_values = [p.get_value() for p in self.paramControls]
+        self.update_ranges()
         toolbar = NavigationToolbar2Tk(self.canvas, self)
         toolbar.update()
         toolbar.pack(side=tkinter.TOP, fill=tkinter.X)
+        self.blitter = blitting.Blitter(self.canvas, self.figure, profiler)
+        # the worker thread and plot_func never access the state of compute_func at the same time,
+        # and the worker waits while a frame is plotted
+        self.lock = threading.Lock()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.compute_func = compute_func
+        self.computed = 0
+        self.plotted = 0
         self.update_interval = False
         self.update_plot(initial=True)
         self.updateID = None
-        if update_interval:
+        if compute_func is not None:
+            self.update_interval = int(1e3 / fps)
+            self.running = True
+            self.worker = threading.Thread(target=self.compute, daemon=True)
+            self.worker.start()
+            self.bind('<Destroy>', self.on_destroy)
+            self.updateID = self.after(self.update_interval, self.render)
+        elif update_interval:
             self.update_interval = int(update_interval * 1e3)
             self.updateID = self.after(self.update_interval, self.update_plot)
 
+    def update_ranges(self):
+        self.param_values = [p.get_value() for p in self.paramControls]
+        for p in self.paramControls:
+            if isinstance(p, ParamFiddle):
+                p.update_range(self.param_values)
+        self.param_values = [p.get_value() for p in self.paramControls]
+
     def on_param_control(self, param_index, value):
+        self.param_values[param_index] = value
+        self.update_ranges()
+        self.blitter.full_redraw = True
+        if self.compute_func is not None:
+            # shown with the next frame
+            return
         if self.updateID is not None:
             self.after_cancel(self.updateID)
             self.updateID = None
-        self.param_values[param_index] = value
         self.update_plot()
 
+    def on_destroy(self, event):
+        self.running = False
+        self.idle.set()
+
+    def compute(self):
+        while self.running:
+            self.idle.wait()
+            with self.lock:
+                self.compute_func()
+                self.computed += 1
+
+    def render(self):
+        # plot the latest state of the worker thread, the states computed in between are dropped
+        if self.blitter.full_redraw or self.plotted != self.computed:
+            self.idle.clear()
+            try:
+                with self.lock:
+                    self.plotted = self.computed
+                    self.redraw()
+            finally:
+                self.idle.set()
+        self.updateID = self.after(self.update_interval, self.render)
+
     def update_plot(self, initial=False):
-        self.plot_func(self.figure, *self.param_values, initial=initial)
-        self.canvas.draw()
+        self.redraw(initial)
         if self.update_interval:
             self.updateID = self.after(self.update_interval, self.update_plot)
 
+    def redraw(self, initial=False):
+        self.blitter.draw(self.plot_func(self.figure, *self.param_values, initial=initial))
+
 
 
 
-def fiddle(plot_func, parameters, update_interval = False):
+def fiddle(plot_func, parameters, update_interval = False, compute_func=None, fps=25, profiler=None):
     window = tkinter.Tk()
     window.geometry('800x800')
     window.title('FiddlePlotter')
-    plotter = FiddlePlotter(window, plot_func, parameters, update_interval=update_interval)
+    plotter = FiddlePlotter(window, plot_func, parameters, update_interval=update_interval,
+                            compute_func=compute_func, fps=fps, profiler=profiler)
     plotter.pack(expand=tkinter.YES, fill=tkinter.BOTH)
     window.mainloop()
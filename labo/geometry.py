@@ -0,0 +1,318 @@
+"""
+Metal objects for fdtd_yee_metal built from primitives
+
+The primitives (Cylinder, Disk, Box, Wire) are combined with | (union) and - (difference), e.g.
+
+can = Cylinder((50, 50), 4, 40, 50, inner=3) | Cylinder((50, 50), 4, 39, 40)
+
+Each primitive is only evaluated inside its bounding box, and rasterize writes all of them into
+one boolean mask of the grid. refine converts the mask to the metal positions of
+fdtd_yee_metal.refine_metal without allocating a (n, n, n, 3) array, and cached_metal saves the
+positions on disk, keyed by the shape and the grid, so that a parameter sweep builds each
+geometry only once.
+
+Coordinates are in voxels, or in units of space_step for a graded mesh (see fdtd_yee_metal.grid_nodes).
+All bounds are included.
+"""
+
+import numpy, os, hashlib, tempfile
+
+
+class Shape:
+
+    def __or__(self, other):
+        return Union(self, other)
+
+    def __sub__(self, other):
+        return Difference(self, other)
+
+    def bounds(self, nodes):
+        """
+        :param nodes: positions of the grid nodes along each axis
+        :return: (lo, hi) smallest box of node indices lo <= i < hi containing the shape
+        """
+        raise NotImplementedError
+
+    def fill(self, mask, nodes, lo):
+        """
+        Set mask to True inside the shape
+        :param mask: boolean array covering the node indices lo <= i < lo + mask.shape
+        """
+        raise NotImplementedError
+
+
+class Primitive(Shape):
+
+    def extent(self):
+        """
+        :return: lower and upper corner of the bounding box in grid coordinates
+        """
+        raise NotImplementedError
+
+    def contains(self, x, y, z):
+        """
+        :param x, y, z: coordinates of the grid nodes, broadcastable against each other
+        :return: boolean array, True inside the shape
+        """
+        raise NotImplementedError
+
+    def bounds(self, nodes):
+        low, high = self.extent()
+        # one more node on each side, contains decides on the nodes close to the limits
+        lo = [max(int(numpy.searchsorted(x, l, 'left')) - 1, 0) for x, l in zip(nodes, low)]
+        hi = [min(int(numpy.searchsorted(x, h, 'right')) + 1, len(x)) for x, h in zip(nodes, high)]
+        return lo, [max(l, h) for l, h in zip(lo, hi)]
+
+    def fill(self, mask, nodes, lo):
+        own_lo, own_hi = self.bounds(nodes)
+        start = [max(a, b) for a, b in zip(own_lo, lo)]
+        stop = [min(a, b + n) for a, b, n in zip(own_hi, lo, mask.shape)]
+        if any(a >= b for a, b in zip(start, stop)):
+            return
+        x, y, z = [x[a:b] for x, a, b in zip(nodes, start, stop)]
+        view = mask[tuple(slice(a - l, b - l) for a, b, l in zip(start, stop, lo))]
+        view |= self.contains(x[:, None, None], y[None, :, None], z[None, None, :])
+
+
+class Cylinder(Primitive):
+
+    def __init__(self, center, radius, start, stop, axis=2, inner=None):
+        """
+        Cylinder, or tube if inner is given
+        :param center: coordinates of the axis in the two other dimensions (e.g. (x, y) for axis=2)
+        :param radius: outer radius
+        :param start, stop: extent along the axis
+        :param axis: direction of the axis, 0->x, 1->y, 2->z
+        :param inner: inner radius of a tube
+        """
+        self.center = tuple(center)
+        self.radius = radius
+        self.start = start
+        self.stop = stop
+        self.axis = axis
+        self.inner = inner
+
+    def __repr__(self):
+        return 'Cylinder(%r, %r, %r, %r, %r, %r)' % (self.center, self.radius, self.start, self.stop, self.axis,
+                                                     self.inner)
+
+    def extent(self):
+        low = [c - self.radius for c in self.center]
+        high = [c + self.radius for c in self.center]
+        low.insert(self.axis, self.start)
+        high.insert(self.axis, self.stop)
+        return low, high
+
+    def contains(self, x, y, z):
+        coordinates = [x, y, z]
+        along = coordinates.pop(self.axis)
+        r = numpy.sqrt((coordinates[0]-self.center[0])**2+(coordinates[1]-self.center[1])**2)
+        inside = r <= self.radius
+        if self.inner is not None:
+            inside = inside & (r >= self.inner)
+        return inside & ((along <= self.stop) & (along >= self.start))
+
+
+class Disk(Cylinder):
+
+    def __init__(self, center, radius, position, axis=2):
+        """
+        Disk one voxel thick in the plane of the grid nodes closest to position
+        :param center: coordinates of the center in the two other dimensions
+        :param position: coordinate along axis
+        """
+        Cylinder.__init__(self, center, radius, position, position, axis)
+
+    def __repr__(self):
+        return 'Disk(%r, %r, %r, %r)' % (self.center, self.radius, self.start, self.axis)
+
+    def bounds(self, nodes):
+        lo, hi = Cylinder.bounds(self, nodes)
+        x = nodes[self.axis]
+        lo[self.axis] = int(numpy.argmin(numpy.abs(x - self.start)))
+        hi[self.axis] = lo[self.axis] + 1
+        return lo, hi
+
+    def contains(self, x, y, z):
+        # only evaluated in the plane chosen by bounds
+        coordinates = [x, y, z]
+        along = coordinates.pop(self.axis)
+        r = numpy.sqrt((coordinates[0]-self.center[0])**2+(coordinates[1]-self.center[1])**2)
+        return (r <= self.radius) & (along == along)
+
+
+class Box(Primitive):
+
+    def __init__(self, lo, hi):
+        """
+        :param lo, hi: lower and upper corners
+        """
+        self.lo = tuple(lo)
+        self.hi = tuple(hi)
+
+    def __repr__(self):
+        return 'Box(%r, %r)' % (self.lo, self.hi)
+
+    def extent(self):
+        return self.lo, self.hi
+
+    def contains(self, x, y, z):
+        inside = True
+        for c, l, h in zip((x, y, z), self.lo, self.hi):
+            inside = inside & (c >= l) & (c <= h)
+        return inside
+
+
+class Wire(Primitive):
+
+    def __init__(self, start, stop, radius=0.5):
+        """
+        Straight wire, the grid nodes closer than radius to the segment between start and stop
+        :param start, stop: ends of the wire
+        :param radius: radius, 0.5 voxel gives a wire one voxel thick along the axes of the grid
+        """
+        self.start = numpy.asarray(start, dtype=float)
+        self.stop = numpy.asarray(stop, dtype=float)
+        self.radius = radius
+
+    def __repr__(self):
+        return 'Wire(%r, %r, %r)' % (tuple(self.start), tuple(self.stop), self.radius)
+
+    def extent(self):
+        return (numpy.minimum(self.start, self.stop) - self.radius,
+                numpy.maximum(self.start, self.stop) + self.radius)
+
+    def contains(self, x, y, z):
+        direction = self.stop - self.start
+        length2 = numpy.sum(direction**2)
+        relative = [c - s for c, s in zip((x, y, z), self.start)]
+        # position of the closest point of the segment
+        t = sum(r * d for r, d in zip(relative, direction)) / length2 if length2 else 0
+        t = numpy.clip(t, 0, 1)
+        distance2 = sum((r - t * d)**2 for r, d in zip(relative, direction))
+        return distance2 <= self.radius**2
+
+
+class Union(Shape):
+
+    def __init__(self, *shapes):
+        self.shapes = shapes
+
+    def __repr__(self):
+        return 'Union(%s)' % ', '.join(map(repr, self.shapes))
+
+    def bounds(self, nodes):
+        boxes = [s.bounds(nodes) for s in self.shapes]
+        return ([min(b[0][i] for b in boxes) for i in range(3)],
+                [max(b[1][i] for b in boxes) for i in range(3)])
+
+    def fill(self, mask, nodes, lo):
+        for shape in self.shapes:
+            shape.fill(mask, nodes, lo)
+
+
+class Difference(Shape):
+
+    def __init__(self, shape, *subtracted):
+        """
+        The points of shape that are not in any of the subtracted shapes
+        """
+        self.shape = shape
+        self.subtracted = subtracted
+
+    def __repr__(self):
+        return 'Difference(%s)' % ', '.join(map(repr, (self.shape,) + self.subtracted))
+
+    def bounds(self, nodes):
+        return self.shape.bounds(nodes)
+
+    def fill(self, mask, nodes, lo):
+        # the difference is formed in a mask covering the bounding box of shape only
+        own_lo, own_hi = self.bounds(nodes)
+        start = [max(a, b) for a, b in zip(own_lo, lo)]
+        stop = [min(a, b + n) for a, b, n in zip(own_hi, lo, mask.shape)]
+        if any(a >= b for a, b in zip(start, stop)):
+            return
+        shape = tuple(b - a for a, b in zip(start, stop))
+        inside = numpy.zeros(shape, dtype=bool)
+        removed = numpy.zeros(shape, dtype=bool)
+        self.shape.fill(inside, nodes, start)
+        for s in self.subtracted:
+            s.fill(removed, nodes, start)
+        view = mask[tuple(slice(a - l, b - l) for a, b, l in zip(start, stop, lo))]
+        view |= inside & ~removed
+
+
+def rasterize(shape, grid_dim, nodes=None):
+    """
+    :param shape: Shape
+    :param grid_dim: 3-tuple, dimensions of the grid
+    :param nodes: positions of the grid nodes along each axis, default is the voxel indices
+    :return: boolean array of shape grid_dim, True in the metal
+    """
+    if nodes is None:
+        nodes = [numpy.arange(n) for n in grid_dim]
+    mask = numpy.zeros(grid_dim, dtype=bool)
+    shape.fill(mask, nodes, (0, 0, 0))
+    return mask
+
+
+def refine(mask):
+    """
+    Same result as fdtd_yee_metal.refine_metal(mask), only working on the bounding box of the metal
+    :return: metal positions (x, y, z, field_component), sorted like numpy.nonzero
+    """
+    lo = []
+    hi = []
+    for axis in range(3):
+        occupied = numpy.flatnonzero(numpy.any(mask, axis=tuple(i for i in range(3) if i != axis)))
+        if len(occupied) == 0:
+            return tuple(numpy.zeros(0, dtype=numpy.intp) for i in range(4))
+        lo.append(occupied[0])
+        # one more voxel, where the normal component at the upper limit of the metal is removed
+        hi.append(min(occupied[-1] + 2, mask.shape[axis]))
+    box = mask[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+    positions = []
+    for component in range(3):
+        # set normal components to 0 at the upper limit of the metal (see refine_metal)
+        refined = box.copy()
+        lower = [slice(None)] * 3
+        upper = [slice(None)] * 3
+        lower[component] = slice(None, -1)
+        upper[component] = slice(1, None)
+        refined[tuple(lower)] &= box[tuple(upper)]
+        if hi[component] < mask.shape[component]:
+            last = [slice(None)] * 3
+            last[component] = -1
+            refined[tuple(last)] = False
+        position = numpy.nonzero(refined)
+        positions.append([p + l for p, l in zip(position, lo)] + [numpy.full(len(position[0]), component)])
+    positions = [numpy.concatenate(p) for p in zip(*positions)]
+    order = numpy.argsort(numpy.ravel_multi_index(positions, mask.shape + (3,)), kind='stable')
+    return tuple(p[order] for p in positions)
+
+
+def cached_metal(shape, grid_dim, nodes=None, directory=None):
+    """
+    Rasterize and refine shape, reusing the result saved in directory by a previous call with the
+    same shape and grid
+    :param directory: cache directory, None for no cache
+    :return: metal positions (see refine)
+    """
+    if directory is None:
+        return refine(rasterize(shape, grid_dim, nodes))
+    key = hashlib.sha1(repr((shape, tuple(grid_dim))).encode())
+    if nodes is not None:
+        for x in nodes:
+            key.update(numpy.ascontiguousarray(x, dtype=float).tobytes())
+    filename = os.path.join(directory, 'metal_%s.npy' % key.hexdigest())
+    if os.path.exists(filename):
+        return tuple(numpy.load(filename))
+    positions = refine(rasterize(shape, grid_dim, nodes))
+    os.makedirs(directory, exist_ok=True)
+    # write to a temporary file first, other processes of a sweep may read the cache at the same time
+    f, temporary = tempfile.mkstemp(dir=directory, suffix='.npy')
+    with os.fdopen(f, 'wb') as f:
+        numpy.save(f, numpy.array(positions))
+    os.replace(temporary, filename)
+    return positions
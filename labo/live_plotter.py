@@ -6,6 +6,7 @@
 import tkinter as tk
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure
+import blitting
 
 class ParamFiddle(tk.Frame):
     """
@@ -66,6 +67,7 @@ class FiddlePlotter(tk.Frame):
         toolbar = NavigationToolbar2Tk(self.canvas, self)
         toolbar.update()
         toolbar.pack(side=tk.TOP, fill=tk.X)
+        self.blitter = blitting.Blitter(self.canvas, self.figure)
         self.updateID = None
         self.update_interval = False
         if self.initial() and update_interval:
@@ -76,17 +78,19 @@ class FiddlePlotter(tk.Frame):
         if self.updateID is not None:
             self.after_cancel(self.updateID)
         self.paramvalues[paramIndex] = value
+        self.blitter.full_redraw = True
         self._update()
-        
+
     def update(self):
         """
-        update plot after parameter change or preiodically
+        update plot after parameter change or preiodically. If it returns a list of artists,
+        only these artists are redrawn (blitting) until a parameter changes or the window
+        is resized.
         """
         pass
         
     def _update(self):
-        self.update()
-        self.canvas.draw()
+        self.blitter.draw(self.update())
         if self.update_interval:
             self.updateID = self.after(self.update_interval, self._update)
 
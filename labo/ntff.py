@@ -0,0 +1,160 @@
+"""
+Near to far field transformation for fdtd_yee_metal
+
+The tangential E and H fields on the faces of a box enclosing the antenna are Fourier transformed
+on the fly at one or several frequencies. The equivalent surface currents J = n x H and M = -n x E
+then give the far field in any direction (C. A. Balanis, Antenna Theory, chapter 12), so that the
+full 3D radiation pattern is obtained from one run with a box much smaller than the far field
+distance.
+"""
+
+import numpy, itertools
+from scipy import constants
+
+
+class NearToFarField:
+
+    def __init__(self, lo, hi, frequencies, space_step, time_step, c, start=0, stop=None, nodes=None):
+        """
+        :param lo: 3-tuple, lower corner of the box in voxels, must be at least 1
+        :param hi: 3-tuple, upper corner of the box in voxels (included)
+        :param frequencies: frequency or list of frequencies in Hz
+        :param space_step: space step in m
+        :param time_step: time step in s
+        :param c: renormalized speed of light (see fdtd_yee_metal.timestep)
+        :param start: first time index included in the Fourier transform
+        :param stop: first time index not included in the Fourier transform, None for no limit
+        :param nodes: positions of the grid nodes along each axis in units of space_step for a graded
+                      mesh (see fdtd_yee_metal.grid_nodes), None for a uniform grid
+        """
+        self.frequencies = numpy.atleast_1d(frequencies).astype(float)
+        self.omega = 2*numpy.pi*self.frequencies
+        self.space_step = space_step
+        self.time_step = time_step
+        self.start = start
+        self.stop = stop
+        # conversion of the renormalized fields to SI units (see fdtd_yee_metal.timestep)
+        self.E_unit = time_step / constants.epsilon_0
+        self.H_unit = c * space_step
+        # number of time steps added to the Fourier transforms, an array so that it is restored with state
+        self.samples = numpy.zeros((), dtype=int)
+        lo = numpy.asarray(lo)
+        hi = numpy.asarray(hi)
+        if nodes is None:
+            nodes = [numpy.arange(h + 2) for h in hi]
+        center = [0.5 * (x[l] + x[h]) for x, l, h in zip(nodes, lo, hi)]
+        self.faces = []
+        for axis, side in itertools.product(range(3), (0, 1)):
+            normal = numpy.zeros(3)
+            normal[axis] = 1 if side else -1
+            region = [slice(l, h+1) for l, h in zip(lo, hi)]
+            region[axis] = slice(hi[axis], hi[axis]+1) if side else slice(lo[axis], lo[axis]+1)
+            # coordinates of the grid nodes of the face along each axis in m
+            coordinates = [(x[r] - m) * space_step for x, r, m in zip(nodes, region, center)]
+            tangential = [i for i in range(3) if i != axis]
+            # trapezoidal rule, the edges and corners are shared with the neighbouring faces
+            shape = tuple(r.stop - r.start for r in region)
+            weight = numpy.ones(shape + (1,))
+            for i in tangential:
+                x = nodes[i][lo[i]:hi[i]+1]
+                step = numpy.diff(x)
+                w = 0.5 * (numpy.concatenate([step, [0]]) + numpy.concatenate([[0], step])) * space_step
+                wshape = [1, 1, 1, 1]
+                wshape[i] = w.size
+                weight = weight * w.reshape(wshape)
+            E = numpy.zeros((len(self.frequencies),) + shape + (3,), dtype=complex)
+            H = numpy.zeros((len(self.frequencies),) + shape + (3,), dtype=complex)
+            self.faces.append((tuple(region), tangential, normal, coordinates, weight, E, H))
+
+    @staticmethod
+    def _interpolate(F, region, component, offsets):
+        """
+        Interpolate component of the field F on the Yee grid to the grid nodes in region.
+        offsets are the axes along which the component is shifted by half a voxel.
+        """
+        value = 0
+        for shift in itertools.product(*[(0, -1) if o else (0,) for o in offsets]):
+            value = value + F[tuple(slice(r.start+s, r.stop+s) for r, s in zip(region, shift)) + (component,)]
+        return value / 2**sum(offsets)
+
+    def update(self, E, B, index):
+        """
+        Add the fields to the Fourier transforms
+        :param E, B: fields after time step index-1, E is at time index and B at index+1/2
+        :param index: time index
+        """
+        if index < self.start or (self.stop is not None and index >= self.stop):
+            return
+        phase_E = numpy.exp(-1j * self.omega * index * self.time_step) * self.time_step
+        phase_B = numpy.exp(-1j * self.omega * (index + 0.5) * self.time_step) * self.time_step
+        for region, tangential, normal, coordinates, weight, E_dft, H_dft in self.faces:
+            for component in tangential:
+                # Yee grid: E_x is shifted by half a voxel along x, B_x along y and z
+                e = self._interpolate(E, region, component, [i == component for i in range(3)])
+                b = self._interpolate(B, region, component, [i != component for i in range(3)])
+                E_dft[..., component] += phase_E[:, None, None, None] * e * self.E_unit
+                H_dft[..., component] += phase_B[:, None, None, None] * b * self.H_unit
+        self.samples += 1
+
+    def state(self):
+        """
+        :return: list of the arrays containing the Fourier transforms (modify in place to restore)
+        """
+        return [a for face in self.faces for a in face[5:]] + [self.samples]
+
+    def radiation_intensity(self, theta, phi, frequency_index=0):
+        """
+        Calculate the radiation intensity in W/sr (up to a constant factor given by the time window)
+        :param theta: polar angles (array)
+        :param phi: azimuthal angles (array of the same shape as theta)
+        :param frequency_index: index of the frequency in frequencies
+        """
+        theta = numpy.asarray(theta, dtype=float)
+        phi = numpy.asarray(phi, dtype=float)
+        k = self.omega[frequency_index] / constants.c
+        eta = numpy.sqrt(constants.mu_0 / constants.epsilon_0)
+        r = numpy.stack([numpy.sin(theta)*numpy.cos(phi), numpy.sin(theta)*numpy.sin(phi), numpy.cos(theta)],
+                        axis=-1).reshape(-1, 3)
+        N = numpy.zeros(r.shape, dtype=complex)
+        L = numpy.zeros(r.shape, dtype=complex)
+        for region, tangential, normal, coordinates, weight, E_dft, H_dft in self.faces:
+            J = numpy.cross(normal, H_dft[frequency_index]) * weight
+            M = -numpy.cross(normal, E_dft[frequency_index]) * weight
+            # the propagation factor exp(j k r.r') is separable along the axes of the face
+            propagation = [numpy.exp(1j * k * r[:, [i]] * x) for i, x in enumerate(coordinates)]
+            N += numpy.einsum('dx,dy,dz,xyzc->dc', *propagation, J, optimize=True)
+            L += numpy.einsum('dx,dy,dz,xyzc->dc', *propagation, M, optimize=True)
+        theta_hat = numpy.stack([numpy.cos(theta)*numpy.cos(phi), numpy.cos(theta)*numpy.sin(phi), -numpy.sin(theta)],
+                                axis=-1).reshape(-1, 3)
+        phi_hat = numpy.stack([-numpy.sin(phi), numpy.cos(phi), 0*phi], axis=-1).reshape(-1, 3)
+        N_theta = numpy.sum(N * theta_hat, axis=-1)
+        N_phi = numpy.sum(N * phi_hat, axis=-1)
+        L_theta = numpy.sum(L * theta_hat, axis=-1)
+        L_phi = numpy.sum(L * phi_hat, axis=-1)
+        U = k**2 / (32 * numpy.pi**2 * eta) * (numpy.abs(L_phi + eta*N_theta)**2 + numpy.abs(L_theta - eta*N_phi)**2)
+        return U.reshape(theta.shape)
+
+    def directivity(self, theta, phi, frequency_index=0, resolution=(37, 72)):
+        """
+        Calculate the directivity in dBi, which equals the gain for an antenna without losses
+        :param theta, phi: directions (see radiation_intensity)
+        :param resolution: number of polar and azimuthal angles used to integrate the radiated power
+        """
+        t, p = numpy.meshgrid(numpy.linspace(0, numpy.pi, resolution[0]),
+                              numpy.linspace(0, 2*numpy.pi, resolution[1], endpoint=False), indexing='ij')
+        # the integrand vanishes at theta = 0 and pi, so the trapezoidal rule is a plain sum
+        power = numpy.sum(self.radiation_intensity(t, p, frequency_index) * numpy.sin(t)) * \
+            numpy.pi / (resolution[0] - 1) * 2*numpy.pi / resolution[1]
+        return 10*numpy.log10(4*numpy.pi*self.radiation_intensity(theta, phi, frequency_index) / power)
+
+    def save(self, filename, resolution=(37, 72)):
+        """
+        Save the directivity in dBi on a (theta, phi) grid for all frequencies in a npz file
+        """
+        if not self.samples:
+            raise ValueError('no time step in the Fourier transform window yet, the directivity is undefined')
+        theta = numpy.linspace(0, numpy.pi, resolution[0])
+        phi = numpy.linspace(0, 2*numpy.pi, resolution[1], endpoint=False)
+        t, p = numpy.meshgrid(theta, phi, indexing='ij')
+        directivity = [self.directivity(t, p, i, resolution) for i in range(len(self.frequencies))]
+        numpy.savez(filename, frequencies=self.frequencies, theta=theta, phi=phi, directivity=directivity)
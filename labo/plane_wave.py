@@ -7,6 +7,7 @@
 # Date 2018/07/14
 
 import live_plotter, numpy, time
+from matplotlib.collections import LineCollection
 
 class WavePlotter(live_plotter.FiddlePlotter):
 
@@ -26,8 +27,10 @@ class WavePlotter(live_plotter.FiddlePlotter):
         self.z = numpy.linspace(0,self.zmax,self.n)
         self.ivec = numpy.arange(0,self.n,5)
         self.axes.plot([0,self.zmax*self.zscale],[0,self.zmax*self.zscale],'k-',lw=3)
-        self.E0 = self.axes.plot([0*self.ivec]*2,[0*self.ivec]*2,'r-',lw=3)
-        self.H0 = self.axes.plot([0*self.ivec]*2,[0*self.ivec]*2,'b-',lw=3)
+        # arrows of E followed by those of H, segments (arrow, start/end, x/y)
+        self.segments = numpy.zeros((2*len(self.ivec),2,2))
+        self.arrows = LineCollection(self.segments, colors=['r']*len(self.ivec) + ['b']*len(self.ivec), lw=3)
+        self.axes.add_collection(self.arrows)
 
         self.Et, = self.axes.plot(0*self.z,0*self.z,'r-',label='E')
         self.Ht, = self.axes.plot(0*self.z,0*self.z,'b-',label='H')
@@ -58,11 +61,16 @@ class WavePlotter(live_plotter.FiddlePlotter):
         Hy = Ex * gamma / 1.0j
         Hx = -Ey * gamma / 1.0j
         zi= self.zscale*self.z
-        for j,i in enumerate(self.ivec):
-            self.E0[j].set_data([zi[i], Ey[i].real + zi[i]], [zi[i], Ex[i].real + zi[i]])
-            self.H0[j].set_data([zi[i], Hy[i].real + zi[i]], [zi[i], Hx[i].real + zi[i]])
+        k = len(self.ivec)
+        self.segments[:,0,:] = numpy.tile(zi[self.ivec], 2)[:,None]
+        self.segments[:k,1,0] = Ey[self.ivec].real + zi[self.ivec]
+        self.segments[:k,1,1] = Ex[self.ivec].real + zi[self.ivec]
+        self.segments[k:,1,0] = Hy[self.ivec].real + zi[self.ivec]
+        self.segments[k:,1,1] = Hx[self.ivec].real + zi[self.ivec]
+        self.arrows.set_segments(self.segments)
         self.Et.set_data(Ey.real + zi, Ex.real + zi)
         self.Ht.set_data(Hy.real + zi, Hx.real + zi)
+        return [self.arrows, self.Et, self.Ht]
         
               
 
@@ -73,7 +81,7 @@ def wave_plot():
                   ("phase y vs x",-180,180,0),
                   ("alpha",0,1,0),
                   ("beta",0,10,1)]
-    live_plotter.open_plotter(WavePlotter, parameters, title="Plane Wave Animation",update_interval=0.05,w=600,h=800)
+    live_plotter.open_plotter(WavePlotter, parameters, title="Plane Wave Animation",update_interval=1/60,w=600,h=800)
 
 
 if __name__ == "__main__":
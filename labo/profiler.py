@@ -0,0 +1,98 @@
+"""
+Timing of the phases of the fdtd_yee_metal time steps (fdtd_yee_metal.py --profile)
+
+A Profiler sums the wall time spent in each phase. The code being timed reads the clock once at
+the start and then calls lap at the end of each phase:
+
+t = profiler.clock()
+...
+t = profiler.lap('curl_B', t)
+...
+t = profiler.lap('inject', t)
+
+The profiler keeps no start time: the start of a phase is the value the caller passes back into
+lap, so the simulation and the plot can be timed from different threads. The totals are however
+shared and not locked: title, summary and save must not run while another thread calls lap. In
+fdtd_yee_metal.py only the lock of fiddle.Fiddle guarantees this, as the worker thread holds it during
+the time steps and the plot, which calls title, runs with it held.
+"""
+
+import sys, time, json, csv
+
+
+def peak_memory():
+    """
+    :return: maximum resident set size of the process in bytes, nan if unknown (Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on macOS, in kB on linux and the BSDs
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Profiler:
+
+    def __init__(self):
+        # total time in s and number of calls of each phase, in the order of the first call
+        self.totals = {}
+        self.calls = {}
+        self.steps = 0
+        self.start = time.perf_counter()
+
+    @staticmethod
+    def clock():
+        return time.perf_counter()
+
+    def lap(self, name, start):
+        """
+        Add the time since start to phase name
+        :return: current time, the start of the next phase
+        """
+        now = time.perf_counter()
+        self.totals[name] = self.totals.get(name, 0) + now - start
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return now
+
+    def step(self):
+        """
+        Count one time step
+        """
+        self.steps += 1
+
+    def summary(self):
+        """
+        :return: dictionary with the number of steps, the elapsed time in s, the steps per second,
+                 the peak memory in MB, and for each phase the total time in s and the time per call in ms
+        """
+        elapsed = time.perf_counter() - self.start
+        result = dict(steps=self.steps, elapsed=elapsed, steps_per_s=self.steps / elapsed,
+                      peak_memory_MB=peak_memory() / 2**20)
+        for name, total in self.totals.items():
+            result[name + '_s'] = total
+            result[name + '_ms_per_call'] = 1e3 * total / self.calls[name]
+        return result
+
+    def title(self):
+        """
+        :return: one line with the step rate, the peak memory and the share of the phases
+        """
+        summary = self.summary()
+        total = sum(self.totals.values()) or 1
+        return '%.1f steps/s %.0f MB ' % (summary['steps_per_s'], summary['peak_memory_MB']) + \
+            ' '.join('%s %.0f%%' % (name, 100 * t / total) for name, t in self.totals.items())
+
+    def save(self, filename):
+        """
+        Save the summary as json, or as a csv table with one row if filename ends with .csv
+        """
+        summary = self.summary()
+        with open(filename, 'w', newline='') as f:
+            if filename.endswith('.csv'):
+                writer = csv.DictWriter(f, fieldnames=list(summary))
+                writer.writeheader()
+                writer.writerow(summary)
+            else:
+                json.dump(summary, f, indent=1)
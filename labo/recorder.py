@@ -0,0 +1,271 @@
+"""
+Recording of the time evolution of fdtd_yee_metal simulations
+
+A Recorder copies slices, probe points or decimated volumes of the fields after the time steps
+into chunks of frames, which a background thread writes to disk while the simulation continues:
+
+directory/recording.npz        description of the streams and metal positions, updated after each chunk
+directory/NAME/000000.npy      frames 0 to chunk_size-1 of stream NAME, shape (frames,) + frame shape
+directory/NAME/000001.npy      ...
+
+With compress=True the chunks are saved as NAME/000000.npz instead. Recording reads only the chunks
+containing the requested frames, uncompressed chunks are memory-mapped. The description only lists
+the frames of the chunks already written, so that a recording interrupted by a crash can be read
+up to its last chunk.
+"""
+
+import numpy, os, queue, threading, tempfile
+
+FIELDS = ('E', 'B')
+
+
+class Stream:
+
+    def __init__(self, name, field, kind, region, shape, dtype, interval, chunk_size, **description):
+        """
+        :param field: 'E' or 'B'
+        :param kind: 'slice', 'probes' or 'volume'
+        :param region: index applied to the field to obtain a frame
+        :param shape: shape of a frame
+        :param interval: number of time steps between frames
+        :param description: further parameters saved in recording.npz (axis, points, ...)
+        """
+        self.name = name
+        self.field = field
+        self.kind = kind
+        self.region = region
+        self.interval = interval
+        self.description = description
+        self.buffer = numpy.empty((chunk_size,) + shape, dtype=dtype)
+        self.count = 0
+        self.chunks = 0
+        self.index = []
+        # number of frames in the chunks written to disk
+        self.written = 0
+
+
+class Recorder:
+
+    def __init__(self, directory, chunk_size=64, compress=False, queue_size=4):
+        """
+        :param directory: directory in which the recording is saved
+        :param chunk_size: number of frames per file
+        :param compress: save the chunks compressed (numpy.savez_compressed), they can then not be memory-mapped
+        :param queue_size: number of chunks waiting to be written before record blocks
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.streams = {}
+        self.space_step = self.time_step = numpy.nan
+        self.shape = ()
+        self.nodes = []
+        self.metal = numpy.zeros((4, 0), dtype=int)
+        self.error = None
+        # the description is written by the simulation thread and by the writer thread
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._describe()
+        self.queue = queue.Queue(queue_size)
+        self.writer = threading.Thread(target=self._write, daemon=True)
+        self.writer.start()
+
+    def _add(self, w, name, field, kind, region, interval, **description):
+        if field not in FIELDS:
+            raise ValueError('field must be one of %s' % (FIELDS,))
+        if name in self.streams:
+            raise ValueError('stream %s already exists' % name)
+        F = getattr(w, field)
+        frame = F[region]
+        os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+        self.streams[name] = Stream(name, field, kind, region, frame.shape, F.dtype, interval, self.chunk_size,
+                                    **description)
+        self.space_step, self.time_step, self.shape = w.space_step, w.time_step, F.shape[:3]
+        self.nodes = w.nodes
+        self.metal = numpy.array(w.metal)
+        self._describe()
+
+    def add_slice(self, w, name, field, axis, index, interval=1):
+        """
+        Record a slice of a field
+        :param w: fdtd_yee_metal.WaveEquation
+        :param name: name of the stream
+        :param field: 'E' or 'B'
+        :param axis: axis perpendicular to the slice, 0->x, 1->y, 2->z
+        :param index: index of the slice along axis
+        :param interval: number of time steps between frames
+        """
+        region = [slice(None)] * 3
+        region[axis] = index
+        self._add(w, name, field, 'slice', tuple(region), interval, axis=axis, slice_index=index)
+
+    def add_probes(self, w, name, field, points, interval=1):
+        """
+        Record a field at probe points, the frames have the shape (len(points), 3)
+        :param points: array of voxel indices with shape (n, 3)
+        """
+        points = numpy.asarray(points, dtype=int).reshape(-1, 3)
+        self._add(w, name, field, 'probes', tuple(points.T), interval, points=points)
+
+    def add_volume(self, w, name, field, decimation=2, interval=1):
+        """
+        Record a field on every decimation-th voxel along each axis
+        """
+        self._add(w, name, field, 'volume', (slice(None, None, decimation),) * 3, interval, decimation=decimation)
+
+    def record(self, w):
+        """
+        Copy the frames due at the current time index of w, call after each time step
+        """
+        for stream in self.streams.values():
+            if w.index % stream.interval:
+                continue
+            stream.buffer[stream.count] = getattr(w, stream.field)[stream.region]
+            stream.index.append(w.index)
+            stream.count += 1
+            if stream.count == self.chunk_size:
+                self._flush(stream)
+
+    def _flush(self, stream):
+        if self.error is not None:
+            raise self.error
+        if stream.count == 0:
+            return
+        filename = os.path.join(self.directory, stream.name, '%06d' % stream.chunks)
+        # the writer thread takes the buffer, record continues in a new one
+        self.queue.put((filename, stream.buffer[:stream.count], stream))
+        stream.buffer = numpy.empty_like(stream.buffer)
+        stream.count = 0
+        stream.chunks += 1
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                filename, frames, stream = item
+                if self.compress:
+                    numpy.savez_compressed(filename + '.npz', frames=frames)
+                else:
+                    numpy.save(filename + '.npy', frames)
+                stream.written += len(frames)
+                self._describe()
+            except Exception as e:
+                # raised in the simulation thread by the next _flush or by close
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        """
+        Write the incomplete chunks and the description of the streams, and stop the writer thread
+        """
+        for stream in self.streams.values():
+            self._flush(stream)
+        self.queue.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+        self._describe()
+
+    def _describe(self):
+        # write recording.npz for the frames written so far, replacing the previous one at once
+        with self.lock:
+            description = dict(names=list(self.streams), chunk_size=self.chunk_size, compress=self.compress,
+                               space_step=self.space_step, time_step=self.time_step, shape=self.shape,
+                               metal=self.metal)
+            for axis, x in zip('xyz', self.nodes):
+                description['nodes_' + axis] = x
+            for name, stream in list(self.streams.items()):
+                description[name + '.field'] = stream.field
+                description[name + '.kind'] = stream.kind
+                description[name + '.interval'] = stream.interval
+                description[name + '.index'] = numpy.array(stream.index[:stream.written], dtype=int)
+                description[name + '.frame_shape'] = stream.buffer.shape[1:]
+                description[name + '.dtype'] = stream.buffer.dtype.str
+                for key, value in stream.description.items():
+                    description[name + '.' + key] = value
+            f, temporary = tempfile.mkstemp(dir=self.directory, suffix='.npz')
+            with os.fdopen(f, 'wb') as f:
+                numpy.savez(f, **description)
+            os.replace(temporary, os.path.join(self.directory, 'recording.npz'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    """
+    Read access to a recording saved by Recorder
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with numpy.load(os.path.join(directory, 'recording.npz')) as description:
+            self.description = {key: description[key] for key in description.files}
+        self.names = [str(name) for name in self.description['names']]
+        self.chunk_size = int(self.description['chunk_size'])
+        self.compress = bool(self.description['compress'])
+        self.space_step = float(self.description['space_step'])
+        self.time_step = float(self.description['time_step'])
+        self.shape = tuple(int(n) for n in self.description['shape'])
+        # positions of the metal as returned by fdtd_yee_metal.refine_metal
+        self.metal = tuple(self.description.get('metal', numpy.zeros((4, 0), dtype=int)))
+        # positions of the grid nodes along each axis in units of space_step (see fdtd_yee_metal.grid_nodes)
+        self.nodes = [self.description.get('nodes_' + axis, numpy.arange(n)) for axis, n in zip('xyz', self.shape)]
+        self.cache = {}
+
+    def get(self, name, key):
+        """
+        :return: parameter key of stream name (field, kind, interval, index, frame_shape, axis, ...)
+        """
+        value = self.description[name + '.' + key]
+        return value.item() if value.ndim == 0 else value
+
+    def index(self, name):
+        """
+        :return: time indices of the frames of stream name
+        """
+        return self.description[name + '.index']
+
+    def chunk(self, name, number):
+        """
+        :return: frames of chunk number of stream name, memory-mapped if not compressed
+        """
+        key = (name, number)
+        if key not in self.cache:
+            filename = os.path.join(self.directory, name, '%06d' % number)
+            if self.compress:
+                with numpy.load(filename + '.npz') as f:
+                    frames = f['frames']
+                # only keep the last decompressed chunk of each stream
+                self.cache = {k: v for k, v in self.cache.items() if k[0] != name}
+            else:
+                frames = numpy.load(filename + '.npy', mmap_mode='r')
+            self.cache[key] = frames
+        return self.cache[key]
+
+    def frame(self, name, i):
+        """
+        :return: frame i of stream name
+        """
+        n = len(self.index(name))
+        if not -n <= i < n:
+            raise IndexError('frame %d out of range' % i)
+        i %= n
+        return self.chunk(name, i // self.chunk_size)[i % self.chunk_size]
+
+    def frames(self, name, start=0, stop=None, step=1):
+        """
+        :return: array of frames start, start+step, ... before stop of stream name, reading only the
+                 chunks containing them
+        """
+        indices = range(*slice(start, stop, step).indices(len(self.index(name))))
+        frames = numpy.empty((len(indices),) + tuple(self.get(name, 'frame_shape')), dtype=self.get(name, 'dtype'))
+        for j, i in enumerate(indices):
+            frames[j] = self.frame(name, i)
+        return frames
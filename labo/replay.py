@@ -0,0 +1,81 @@
+"""
+Replay of a simulation recorded with fdtd_yee_metal.py --headless --record DIRECTORY
+
+python replay.py DIRECTORY
+
+The E and B volumes of the recording are memory-mapped, so that any frame is shown without
+reading the whole recording. The frame slider scrubs through time.
+"""
+
+import numpy, argparse
+import fdtd_yee_metal, recorder
+
+
+class Replay:
+
+    def __init__(self, directory):
+        """
+        :param directory: recording containing E and B volumes (see recorder.Recorder.add_volume)
+        """
+        self.recording = recorder.Recording(directory)
+        self.streams = {}
+        for name in self.recording.names:
+            if self.recording.get(name, 'kind') == 'volume':
+                self.streams.setdefault(self.recording.get(name, 'field'), name)
+        if set(self.streams) != set(recorder.FIELDS):
+            raise ValueError('%s does not contain volumes of E and B' % directory)
+        E, B = self.streams['E'], self.streams['B']
+        if not numpy.array_equal(self.recording.index(E), self.recording.index(B)):
+            raise ValueError('the E and B volumes must be recorded at the same time steps')
+        self.times = self.recording.index(E)
+        decimation = self.recording.get(E, 'decimation')
+        self.space_step = self.recording.space_step
+        # positions of the recorded nodes in units of space_step, graded if the simulation was
+        self.nodes = [x[::decimation] for x in self.recording.nodes]
+        self.time_step = self.recording.time_step
+        # metal positions on the decimated grid
+        metal = numpy.array(self.recording.metal).reshape(4, -1)
+        kept = numpy.all(metal[:3] % decimation == 0, axis=0)
+        self.metal = tuple(metal[:3, kept] // decimation) + (metal[3, kept],)
+        self.shape = tuple(int(n) for n in self.recording.get(E, 'frame_shape'))
+        self.plot_key = None
+        self.load(0)
+
+    def __len__(self):
+        return len(self.times)
+
+    def load(self, frame):
+        """
+        Make frame the current frame, E and B are then memory-mapped views of the recording
+        """
+        self.E = self.recording.frame(self.streams['E'], frame)
+        self.B = self.recording.frame(self.streams['B'], frame)
+        self.index = int(self.times[frame])
+
+    # same plotting as the live simulation
+    plot = fdtd_yee_metal.WaveEquation.plot
+
+    def show(self, figure, field, component, slice, slice_index, frame, initial=False):
+        """
+        Plot selected field component of the given frame (see fdtd_yee_metal.WaveEquation.plot)
+        """
+        self.load(int(frame))
+        return self.plot(figure, field, component, slice, int(slice_index), initial)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay of a simulation recorded with fdtd_yee_metal.py --record')
+    parser.add_argument('directory', help='directory of the recording')
+    args = parser.parse_args()
+
+    import fiddle
+    replay = Replay(args.directory)
+    fiddle.fiddle(replay.show, [('field',{'E':fdtd_yee_metal.EFIELD,'B':fdtd_yee_metal.BFIELD,
+                                          'Energy density':fdtd_yee_metal.ENERGY_DENSITY,
+                                          'Poynting':fdtd_yee_metal.POYNTING, 'Metal':fdtd_yee_metal.METAL},'E'),
+                                ('component',{'X':0, 'Y':1, 'Z':2,'norm':fdtd_yee_metal.NORM,
+                                              'dB':fdtd_yee_metal.DECIBEL},'norm'),
+                                ('slice',{'XY':2,'YZ':0,'XZ':1},'XZ'),
+                                ('slice index',0,lambda field, component, slice, index, frame: replay.shape[slice]-1,
+                                 replay.shape[1]//2,1),
+                                ('frame',0,len(replay)-1,len(replay)-1,1)])
@@ -0,0 +1,295 @@
+"""
+Statistics of the power levels in captures of serial_plotter.py (--capture NAME)
+
+python rssi_analysis.py NAME [NAME ...] --output statistics.csv --window 60 --hop 10 --windows windows.npz
+
+For each capture and each access point (ssid, security, channel), and for each channel over all
+access points: number of measurements, mean power (averaged in mW and converted to dBm), 10%, 50%
+and 90% percentiles, minimum and maximum, and the mean power in windows of WINDOW s starting every
+HOP s (consecutive windows by default, overlapping windows if HOP is shorter than WINDOW).
+
+The captures are memory-mapped and parsed in blocks of lines with numpy operations on the bytes,
+so that the memory used does not depend on the size of the captures. The statistics are computed
+from histograms of the rssi (an integer in dBm) of each access point accumulated over the blocks.
+"""
+
+import numpy, os, argparse, csv
+
+# rssi is an int8 on the ESP32
+RSSI_MIN = -128
+BINS = 256
+SSID_LENGTH = 32
+SECURITY_LENGTH = 16
+KEY = numpy.dtype([('ssid', 'S%d' % SSID_LENGTH), ('security', 'S%d' % SECURITY_LENGTH), ('channel', int)])
+
+
+def _starts_with(log, starts, prefix):
+    # the line end (\n) never matches, so the comparison stops within each line
+    match = numpy.ones(len(starts), dtype=bool)
+    for k, c in enumerate(prefix):
+        match &= log[numpy.minimum(starts + k, len(log) - 1)] == c
+    return match
+
+
+def _integers(log, start, stop, width=5):
+    """
+    :return: values of the integers written in log[start:stop], and False where they are not integers
+    """
+    negative = log[numpy.minimum(start, len(log) - 1)] == ord('-')
+    start = start + negative
+    value = numpy.zeros(len(start), dtype=int)
+    valid = (stop > start) & (stop - start <= width)
+    for k in range(width):
+        inside = start + k < stop
+        digit = log[numpy.minimum(start + k, len(log) - 1)].astype(int) - ord('0')
+        valid &= ~inside | ((digit >= 0) & (digit <= 9))
+        value = numpy.where(inside, value * 10 + digit, value)
+    return numpy.where(negative, -value, value), valid
+
+
+def _strings(log, start, stop, width):
+    """
+    :return: array of the byte strings log[start:stop] truncated to width
+    """
+    width = max(1, min(width, numpy.max(stop - start, initial=0)))
+    index = start[:, None] + numpy.arange(width)
+    chars = numpy.where(index < stop[:, None], log[numpy.minimum(index, len(log) - 1)], 0).astype(numpy.uint8)
+    return numpy.ascontiguousarray(chars).view('S%d' % width).ravel()
+
+
+def parse(log, times):
+    """
+    Parse complete lines printed by SignalPower.ino
+    :param log: uint8 array of lines ending with \\n
+    :param times: times of arrival of the lines, at least one per line
+    :return: dictionary of columns for the access point lines: time, scan (number of the scan in
+             the block), ssid, security, channel and rssi
+    """
+    ends = numpy.flatnonzero(log == ord('\n'))
+    starts = numpy.concatenate([[0], ends[:-1] + 1])
+    times = numpy.asarray(times[:len(ends)])
+    is_scan = _starts_with(log, starts, b'Scan complete')
+    scan = numpy.cumsum(is_scan) - is_scan
+    is_ap = _starts_with(log, starts, b'ssid=')
+    start, end = starts[is_ap], ends[is_ap]
+    end = end - (log[numpy.maximum(end - 1, 0)] == ord('\r'))
+    # the last three = of the line are those of security, channel and rssi, the ssid may contain =
+    equal = numpy.flatnonzero(log == ord('='))
+    last = numpy.searchsorted(equal, end)
+    r, c, s = (equal[numpy.maximum(last - k, 0)] for k in (1, 2, 3))
+    valid = (last >= 3) & (s > start + 4)
+    for position, name in [(r, b' rssi'), (c, b' channel'), (s, b' security')]:
+        valid &= _starts_with(log, numpy.maximum(position - len(name), 0), name)
+    rssi, valid_rssi = _integers(log, r + 1, end)
+    channel, valid_channel = _integers(log, c + 1, r - len(b' rssi'))
+    valid &= valid_rssi & valid_channel & (rssi >= RSSI_MIN) & (rssi < RSSI_MIN + BINS)
+    return dict(time=times[is_ap][valid], scan=scan[is_ap][valid],
+                ssid=_strings(log, start + len(b'ssid='), s - len(b' security'), SSID_LENGTH)[valid],
+                security=_strings(log, s + 1, c - len(b' channel'), SECURITY_LENGTH)[valid],
+                channel=channel[valid], rssi=rssi[valid])
+
+
+def read_capture(name, block_size=2**26):
+    """
+    Parse a capture of serial_plotter.py in blocks of lines
+    :param name: name of the capture (NAME.log and NAME.time)
+    :param block_size: number of bytes parsed at once
+    :return: iterator over the columns of the blocks (see parse)
+    """
+    if os.path.getsize(name + '.log') == 0:
+        return
+    log = numpy.memmap(name + '.log', dtype=numpy.uint8, mode='r')
+    times = numpy.memmap(name + '.time', dtype=numpy.float64, mode='r')
+    position = 0
+    line = 0
+    while position < len(log):
+        block = log[position:position + block_size]
+        ends = numpy.flatnonzero(block == ord('\n'))
+        if len(ends) == 0:
+            if position + block_size >= len(log):
+                # incomplete last line
+                return
+            # a line longer than block_size is not a line of SignalPower.ino
+            position += block_size
+            continue
+        # an interrupted capture may have fewer times than lines, the lines without time are ignored
+        ends = ends[:len(times) - line]
+        if len(ends) == 0:
+            return
+        block = block[:ends[-1] + 1]
+        yield parse(numpy.asarray(block), times[line:line + len(ends)])
+        position += len(block)
+        line += len(ends)
+
+
+class Statistics:
+    """
+    Histograms of the rssi of each access point, and sums of the power in intervals of hop s, which
+    are combined into windows by windows()
+    """
+
+    def __init__(self, window=60., hop=None):
+        """
+        :param window: duration of the windows in s
+        :param hop: time between the starts of consecutive windows in s, default is window. window is
+                    rounded to a multiple of hop.
+        """
+        self.hop = window if hop is None else hop
+        self.window = window
+        # number of intervals per window
+        self.intervals = max(1, int(round(window / self.hop)))
+        self.keys = {}
+        self.histogram = numpy.zeros((0, BINS), dtype=numpy.int64)
+        self.window_power = numpy.zeros((0, 0))
+        self.window_count = numpy.zeros((0, 0), dtype=numpy.int64)
+        self.start = None
+
+    def add(self, columns):
+        """
+        Add the measurements of a block (see parse)
+        """
+        if len(columns['rssi']) == 0:
+            return
+        key = numpy.empty(len(columns['rssi']), dtype=KEY)
+        for name in KEY.names:
+            key[name] = columns[name]
+        unique, inverse = _unique(key)
+        group = numpy.array([self.keys.setdefault(k.item(), len(self.keys)) for k in unique])[inverse]
+        n = len(self.keys)
+        histogram = numpy.bincount(group * BINS + columns['rssi'] - RSSI_MIN, minlength=n * BINS)
+        self.histogram = _grow(self.histogram, (n, BINS))
+        self.histogram += histogram.reshape(n, BINS)
+        if self.start is None:
+            self.start = columns['time'][0]
+        window = ((columns['time'] - self.start) // self.hop).astype(int)
+        # measurements before the first one (the clock may go back) are put in the first interval
+        window = numpy.maximum(window, 0)
+        m = max(self.window_count.shape[1], numpy.max(window) + 1)
+        self.window_count = _grow(self.window_count, (n, m))
+        self.window_power = _grow(self.window_power, (n, m))
+        index = group * m + window
+        self.window_count += numpy.bincount(index, minlength=n * m).reshape(n, m)
+        self.window_power += numpy.bincount(index, 10**(columns['rssi'] / 10), minlength=n * m).reshape(n, m)
+
+    def groups(self):
+        """
+        :return: list of (ssid, security, channel) in the order of the statistics, access points
+                 first and then the channels, with ssid and security '*'
+        """
+        access_points = [(ssid.decode('utf8', 'replace'), security.decode('ascii', 'replace'), channel)
+                         for ssid, security, channel in self.keys]
+        return access_points + [('*', '*', channel) for channel in self._channels()]
+
+    def _channels(self):
+        return sorted(set(channel for ssid, security, channel in self.keys))
+
+    def _combined(self, array):
+        # access points followed by the sums over the access points of each channel
+        channel = numpy.array([key[2] for key in self.keys], dtype=int)
+        return numpy.concatenate([array] + [array[channel == c].sum(axis=0, keepdims=True) for c in self._channels()])
+
+    def table(self, percentiles=(10, 50, 90)):
+        """
+        :return: list of dictionaries with ssid, security, channel, count, mean (dBm, average of the power
+                 in mW), the percentiles p10, p50, ... (smallest rssi such that at least this percentage
+                 of the measurements are lower or equal), min and max
+        """
+        histogram = self._combined(self.histogram)
+        rssi = numpy.arange(BINS) + RSSI_MIN
+        count = histogram.sum(axis=1)
+        cumulative = numpy.cumsum(histogram, axis=1)
+        rows = []
+        for i, (ssid, security, channel) in enumerate(self.groups()):
+            row = dict(ssid=ssid, security=security, channel=channel, count=count[i],
+                       mean=10*numpy.log10(numpy.sum(histogram[i] * 10**(rssi / 10)) / count[i]))
+            for p in percentiles:
+                row['p%d' % p] = rssi[numpy.argmax(cumulative[i] >= p / 100 * count[i])]
+            occupied = numpy.flatnonzero(histogram[i])
+            row['min'], row['max'] = rssi[occupied[0]], rssi[occupied[-1]]
+            rows.append(row)
+        return rows
+
+    def windows(self):
+        """
+        :return: start times of the windows (s since the first measurement, every hop s) and mean power
+                 in dBm in each window for each group (see groups), nan where there is no measurement
+        """
+        # sums over the intervals of each window from the cumulative sums over the intervals
+        k = self.intervals
+        count, power = (self._combined(_grow(a, (a.shape[0], max(a.shape[1], k))))
+                        for a in (self.window_count, self.window_power))
+        count, power = (numpy.concatenate([numpy.zeros((len(a), 1), a.dtype), numpy.cumsum(a, axis=1)], axis=1)
+                        for a in (count, power))
+        count = count[:, k:] - count[:, :-k]
+        power = power[:, k:] - power[:, :-k]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            mean = 10*numpy.log10(power / count)
+        return numpy.arange(count.shape[1]) * self.hop, numpy.where(count > 0, mean, numpy.nan)
+
+
+def _unique(key):
+    """
+    Same as numpy.unique(key, return_inverse=True) for an array of KEY, sorting a hash of the keys
+    instead of the keys, which is much faster
+    """
+    words = key.view(numpy.uint64).reshape(len(key), -1)
+    multipliers = numpy.random.default_rng(0).integers(1, 2**63, words.shape[1], dtype=numpy.uint64) | 1
+    hashed = words @ multipliers
+    hashed, index, inverse = numpy.unique(hashed, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    if numpy.all(words[index][inverse] == words):
+        return key[index], inverse
+    # collision of the hashes
+    unique, inverse = numpy.unique(key, return_inverse=True)
+    return unique, inverse.ravel()
+
+
+def _grow(array, shape):
+    # zero padded copy of array with the given shape, or array itself if it already has this shape
+    if array.shape == shape:
+        return array
+    grown = numpy.zeros(shape, dtype=array.dtype)
+    grown[:array.shape[0], :array.shape[1]] = array
+    return grown
+
+
+def analyze(name, window=60., hop=None, block_size=2**26):
+    """
+    :return: Statistics of capture name (see read_capture)
+    """
+    statistics = Statistics(window, hop)
+    for columns in read_capture(name, block_size):
+        statistics.add(columns)
+    return statistics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Statistics of the power levels in captures of serial_plotter.py')
+    parser.add_argument('captures', nargs='+', help='names of the captures (NAME.log and NAME.time)')
+    parser.add_argument('--window', type=float, default=60., help='duration of the windows in s')
+    parser.add_argument('--hop', type=float, default=None,
+                        help='time between the starts of the windows in s, default is WINDOW (consecutive windows)')
+    parser.add_argument('--output', default=None, help='csv file in which the statistics are saved')
+    parser.add_argument('--windows', default=None, help='npz file in which the mean power in the windows is saved')
+    args = parser.parse_args()
+
+    rows = []
+    windows = {}
+    for name in args.captures:
+        statistics = analyze(name, args.window, args.hop)
+        for row in statistics.table():
+            rows.append(dict(capture=name, **row))
+        start, mean = statistics.windows()
+        windows[name + '.start'] = start
+        windows[name + '.mean'] = mean
+        windows[name + '.groups'] = numpy.array([' '.join(map(str, group)) for group in statistics.groups()])
+    columns = ['capture', 'ssid', 'security', 'channel', 'count', 'mean', 'p10', 'p50', 'p90', 'min', 'max']
+    for row in rows:
+        print('%-12s %-32s %-10s %3d %8d %8.2f %5d %5d %5d %5d %5d' % tuple(row[c] for c in columns))
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+    if args.windows is not None:
+        numpy.savez(args.windows, **windows)
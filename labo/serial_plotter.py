@@ -1,80 +1,369 @@
+"""
+Plot of the WiFi power levels measured by SignalPower.ino
+
+python serial_plotter.py PORT [PORT ...]                 live plot of one or several devices
+python serial_plotter.py PORT --capture NAME             also save the lines received in NAME.log and NAME.time
+python serial_plotter.py --replay NAME [--speed 10]      plot a capture again, in real time or faster
+python serial_plotter.py --simulate 1 --scan-rate 40     plot simulated devices (see esp32_simulator.py)
+
+A capture consists of NAME.log, the lines as received, and NAME.time, the times of arrival of the
+lines as float64 (time.time()). With several ports, the captures are NAME_0, NAME_1, ...
+"""
+
 from serial import Serial
-import numpy, time, fiddle, sys
+import numpy, time, fiddle, re, queue, threading, collections, argparse
+
+# lines printed by SignalPower.ino, the ssid may contain spaces
+ACCESS_POINT = re.compile(rb'ssid=(.*) security=(\S+) channel=(\d+) rssi=(-?\d+)\s*$')
+SCAN_COMPLETE = re.compile(rb'Scan complete, found (\d+) APs')
+
+# time of arrival in s (time.time()), index of the device in SerialPlotter, and the fields of the line
+AccessPoint = collections.namedtuple('AccessPoint', 'time source ssid security channel rssi')
+ScanComplete = collections.namedtuple('ScanComplete', 'time source count')
+
+
+def parse_line(line, t, source=0):
+    """
+    :param line: line received from SignalPower.ino (bytes)
+    :param t: time of arrival
+    :return: AccessPoint, ScanComplete, or None if the line is not recognized
+    """
+    match = ACCESS_POINT.match(line)
+    if match is not None:
+        ssid, security, channel, rssi = match.groups()
+        return AccessPoint(t, source, ssid.decode('utf8', 'replace'), security.decode('ascii', 'replace'),
+                           int(channel), int(rssi))
+    match = SCAN_COMPLETE.match(line)
+    if match is not None:
+        return ScanComplete(t, source, int(match.group(1)))
+    return None
+
+
+class SerialReader:
+    """
+    Thread reading the lines of a device, which puts them with their time of arrival as records
+    (see parse_line) into a queue, independently of the refresh of the plot
+    """
+
+    def __init__(self, stream, records, source=0, capture=None):
+        """
+        :param stream: serial port with a timeout
+        :param records: queue.SimpleQueue receiving the records
+        :param source: number of the device, copied to the records
+        :param capture: optional Capture saving the lines
+        """
+        self.stream = stream
+        self.records = records
+        self.source = source
+        self.capture = capture
+        self.stopped = threading.Event()
+        # exception that stopped the thread, raised in the plot thread by SerialPlotter
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.read()
+        except Exception as e:
+            self.error = e
+
+    def read(self):
+        pending = b''
+        while not self.stopped.is_set():
+            # wait for the first byte, then take all bytes received (readline reads one byte at a time)
+            data = self.stream.read(max(1, self.stream.in_waiting))
+            if not data:
+                continue
+            t = time.time()
+            lines = (pending + data).split(b'\n')
+            # incomplete last line
+            pending = lines.pop()
+            for line in lines:
+                line += b'\n'
+                record = parse_line(line, t, self.source)
+                if self.capture is not None:
+                    self.capture.write(line, t)
+                    if isinstance(record, ScanComplete):
+                        self.capture.flush()
+                if record is not None:
+                    self.records.put(record)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        if self.stream is not None:
+            self.stream.close()
+        if self.capture is not None:
+            self.capture.close()
+
+
+class Capture:
+    """
+    Lines received from a device and their times of arrival, saved in NAME.log and NAME.time
+    """
+
+    def __init__(self, name):
+        self.log = open(name + '.log', 'wb')
+        self.time = open(name + '.time', 'wb')
+
+    def write(self, line, t):
+        self.log.write(line)
+        self.time.write(numpy.float64(t).tobytes())
+
+    def flush(self):
+        self.log.flush()
+        self.time.flush()
+
+    def close(self):
+        self.log.close()
+        self.time.close()
+
+
+def read_capture(name):
+    """
+    :return: lines of capture NAME and array of their times of arrival
+    """
+    with open(name + '.log', 'rb') as f:
+        lines = f.readlines()
+    times = numpy.fromfile(name + '.time', dtype=numpy.float64)
+    # an interrupted capture may have one more line than times or the opposite
+    n = min(len(lines), len(times))
+    return lines[:n], times[:n]
+
+
+class ReplayReader(SerialReader):
+    """
+    Thread putting the records of a capture into a queue like SerialReader, with their recorded times
+    """
+
+    def __init__(self, name, records, source=0, speed=1.0):
+        """
+        :param name: name of the capture (see Capture)
+        :param speed: replay speed, 1 for real time, None for as fast as possible
+        """
+        self.lines, self.times = read_capture(name)
+        self.speed = speed
+        SerialReader.__init__(self, None, records, source)
+
+    def read(self):
+        start = time.time()
+        for line, t in zip(self.lines, self.times):
+            if self.speed is not None:
+                # wait for the time of the line, stop returns at once
+                if self.stopped.wait(max(0, start + (t - self.times[0]) / self.speed - time.time())):
+                    return
+            elif self.stopped.is_set():
+                return
+            record = parse_line(line, t, self.source)
+            if record is not None:
+                self.records.put(record)
+
+
+
+class RingBuffer:
+    """
+    Rows of floats in a preallocated buffer. The capacity doubles when the buffer is full, until
+    max_size rows, after which the oldest rows are overwritten. Row 0 is the oldest row.
+    """
+
+    def __init__(self, columns, capacity=1024, max_size=None):
+        if max_size is not None:
+            capacity = min(capacity, max_size)
+        self.data = numpy.empty((capacity, columns))
+        self.max_size = max_size
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, row):
+        capacity = len(self.data)
+        if self.count == capacity and (self.max_size is None or capacity < self.max_size):
+            grown = 2 * capacity if self.max_size is None else min(2 * capacity, self.max_size)
+            data = numpy.empty((grown, self.data.shape[1]))
+            data[:self.count] = self.take(numpy.arange(self.count))
+            self.data = data
+            self.start = 0
+            capacity = grown
+        if self.count == capacity:
+            self.data[self.start] = row
+            self.start = (self.start + 1) % capacity
+        else:
+            self.data[(self.start + self.count) % capacity] = row
+            self.count += 1
+
+    def take(self, index):
+        """
+        :param index: array of row numbers, 0 is the oldest row
+        :return: array of these rows
+        """
+        return self.data[(self.start + index) % len(self.data)]
+
+    def decimated(self, max_points):
+        """
+        :return: at most max_points row numbers evenly spread over the buffer, including the first and last row
+        """
+        return numpy.unique(numpy.linspace(0, self.count - 1, min(self.count, max_points)).astype(int))
+
 
 class PowerTrace:
-    def __init__(self, axes, label, t0, t, power):
+    def __init__(self, axes, label, t0, t, power, max_points=2000, max_size=None):
+        """
+        :param t0: time of the origin of the time axis
+        :param t, power: first point, power in dBm
+        :param max_points: maximum number of points shown
+        :param max_size: number of points kept, None for all of them
+        """
         self.t0 = t0
-        t -= t0
-        color = next(axes._get_lines.prop_cycler)['color']
-        self.line = [axes.plot([t], [power],'.', color=color)[0],
-                     axes.plot([t], [power], '-',label=label, lw=3, color=color)[0]]
+        self.max_points = max_points
+        # time, power in dBm, and sum of the power in mW since the first point (also overwritten points),
+        # so that the average over any number of points takes a difference of two sums
+        self.points = RingBuffer(3, max_size=max_size)
+        self.total = 0.0
+        points, = axes.plot([], [],'.')
+        self.line = [points, axes.plot([], [], '-',label=label, lw=3, color=points.get_color())[0]]
         axes.set_xlim(0,50)
         axes.set_ylim(-90,0)
+        self.add_point(t, power, 1)
 
+    def add_point(self, time, power, width):
+        """
+        Add a point and show the average of the power in mW over the last width points in dBm.
+        Only the decimated points are updated, so the cost does not depend on the length of the trace.
+        """
+        self.append(time, power)
+        self.show(width)
 
+    def append(self, time, power):
+        """
+        Add a point without updating the plot (see show)
+        """
+        self.total += 10**(power/10)
+        self.points.append((time-self.t0, power, self.total))
 
-    def add_point(self, time, power, width):
-        x, y = self.line[0].get_data()
-        x = numpy.append(x, time-self.t0)
-        y = numpy.append(y, power)
+    def show(self, width):
+        self.width = width
+        index = self.points.decimated(self.max_points)
+        x, y, total = self.points.take(index).T
         self.line[0].set_data(x, y)
-        filter = numpy.ones(width)/width
-        if width < y.size:
-            self.line[1].set_data(x[width-1:], numpy.log(numpy.convolve(numpy.exp(y), filter, 'valid')))
+        n = len(self.points)
+        if width < n:
+            # averages over the points i-width+1 to i
+            index = index[index >= width-1]
+            last = self.points.take(index)
+            first = self.points.take(index - width + 1)
+            average = (last[:,2] - first[:,2] + 10**(first[:,1]/10)) / width
+            self.line[1].set_data(last[:,0], 10*numpy.log10(average))
         else:
-            self.line[1].set_data([x[0],x[-1]],[numpy.average(y)]*2)
+            first, last = self.points.take(numpy.array([0, n-1]))
+            average = (last[2] - first[2] + 10**(first[1]/10)) / n
+            self.line[1].set_data([first[0],last[0]],[10*numpy.log10(average)]*2)
 
 
 class SerialPlotter:
-    def __init__(self, port):
-        self.s = Serial(port=port, timeout=0.0, baudrate=115200)
+    def __init__(self, ports=(), capture=None, replay=(), speed=1.0):
+        """
+        :param ports: serial ports of the devices running SignalPower.ino
+        :param capture: if given, name of the capture of the lines received (see Capture)
+        :param replay: names of captures to plot again instead of ports
+        :param speed: replay speed, 1 for real time, None for as fast as possible
+        """
+        self.records = queue.SimpleQueue()
+        self.readers = []
+        for i, port in enumerate(ports):
+            name = None
+            if capture is not None:
+                name = capture if len(ports) == 1 else '%s_%d' % (capture, i)
+            self.readers.append(SerialReader(Serial(port=port, timeout=0.1, baudrate=115200), self.records, i,
+                                             None if name is None else Capture(name)))
+        for i, name in enumerate(replay):
+            self.readers.append(ReplayReader(name, self.records, len(ports) + i, speed))
+        self.ports = list(ports) + list(replay)
         self.traces = {}
         self.t0 = time.time()
+        replayed = [reader.times[0] for reader in self.readers if isinstance(reader, ReplayReader) and len(reader.times)]
+        if replayed and not ports:
+            # time axis of the captures
+            self.t0 = min(replayed)
+        # rssi of the current scan of each device, by (source, channel)
         self.points = {}
 
+    def batch(self):
+        """
+        :return: list of the records received since the last call
+        """
+        records = []
+        try:
+            while True:
+                records.append(self.records.get_nowait())
+        except queue.Empty:
+            return records
+
     def __call__(self, fig, width, initial=False):
+        for reader in self.readers:
+            if reader.error is not None:
+                raise reader.error
         if initial:
             ax = fig.add_subplot(111)
             ax.set_xlabel('time since start (s)')
             ax.set_ylabel('power (dBm)')
         else:
             ax, = fig.get_axes()
-            
-        lines = self.s.readlines()
-        for line in lines:
-            line = line.decode('utf8')
-            if line.startswith('Scan complete'):
-                for channel in self.points:
-                    power = numpy.average(self.points[channel])
-                    if channel in self.traces:
-                        self.traces[channel].add_point(time.time(), power, width)
-                    else:
-                        self.traces[channel] = PowerTrace(ax, "Channel " + channel, self.t0, time.time(), power)
-                        ax.legend()
-                self.points = {}
-                continue
-            line = line.split()
-            if len(line) != 4:
-                continue
-            try:
-                ap = {x[0]:x[1] for x in [word.split('=') for word in line]}
-            except:
-                continue
-            channel = ap['channel']
-            power = int(ap['rssi'])
-            if channel in self.points:
-                self.points[channel].append(power)
-            else:
-                self.points[channel] = [power]
-                
-            
 
+        updated = set()
+        for record in self.batch():
+            if isinstance(record, AccessPoint):
+                self.points.setdefault((record.source, record.channel), []).append(record.rssi)
+                continue
+            # the scan of this device is complete, add a point at the time of arrival of the line
+            for key in [key for key in self.points if key[0] == record.source]:
+                power = numpy.average(self.points.pop(key))
+                if key in self.traces:
+                    self.traces[key].append(record.time, power)
+                else:
+                    label = "Channel %d" % key[1]
+                    if len(self.ports) > 1:
+                        label = "%s %s" % (self.ports[key[0]], label)
+                    self.traces[key] = PowerTrace(ax, label, self.t0, record.time, power)
+                    ax.legend()
+                updated.add(key)
+        for key in self.traces:
+            if key in updated or width != self.traces[key].width:
+                self.traces[key].show(width)
 
+    def close(self):
+        """
+        Stop the readers and close the captures
+        """
+        for reader in self.readers:
+            reader.stop()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) <= 1:
-        print("Usage: %s SERIAL_PORT" % sys.argv[0])
-        exit(1)
-    plotter = SerialPlotter(sys.argv[1])
-    fiddle.fiddle(plotter, [('filter width', 1, 50, 10,1)], update_interval=0.1)
+    parser = argparse.ArgumentParser(description='Plot of the WiFi power levels measured by SignalPower.ino')
+    parser.add_argument('ports', nargs='*', help='serial ports of the devices')
+    parser.add_argument('--capture', default=None, help='save the lines received in CAPTURE.log and CAPTURE.time')
+    parser.add_argument('--replay', nargs='+', default=[], help='names of captures to plot instead of ports')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 0 for as fast as possible')
+    parser.add_argument('--simulate', type=int, default=0, help='number of simulated devices (see esp32_simulator.py)')
+    parser.add_argument('--scan-rate', type=float, default=0.4, help='scans per second of the simulated devices')
+    args = parser.parse_args()
+    ports = list(args.ports)
+    devices = []
+    if args.simulate:
+        import esp32_simulator
+        devices = [esp32_simulator.SimulatedESP32(scan_rate=args.scan_rate, seed=i) for i in range(args.simulate)]
+        ports += [device.port for device in devices]
+    try:
+        if not ports and not args.replay:
+            parser.error('give at least one serial port, --replay or --simulate')
+        plotter = SerialPlotter(ports, args.capture, args.replay, args.speed or None)
+        try:
+            fiddle.fiddle(plotter, [('filter width', 1, 50, 10,1)], update_interval=0.1)
+        finally:
+            plotter.close()
+    finally:
+        for device in devices:
+            device.close()
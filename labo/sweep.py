@@ -0,0 +1,133 @@
+"""
+Parameter sweep of the cantenna geometry
+
+Every combination of can radius, can height, feed height and frequency is simulated without user
+interface in a separate process and the gains are collected in one table, e.g.
+
+python sweep.py --radius 0.04 0.0475 0.055 --height 0.1 0.133 --feed 0.04 0.06 --output sweep.csv
+"""
+
+import numpy, os, csv, itertools, argparse, concurrent.futures
+import fdtd_yee_metal, profiler
+
+COLUMNS = ['radius', 'height', 'feed', 'frequency', 'gain', 'front_to_back', 'directivity']
+
+
+def simulate(parameters, n=100, far_field=False, **kwargs):
+    """
+    Simulate one cantenna geometry
+    :param parameters: (can radius, can height, feed height, frequency), lengths in m and frequency in Hz
+    :param n: grid size n x n x n
+    :param far_field: also calculate the maximum directivity with the near to far field transformation
+    :param kwargs: further arguments of dipole_simulation (backend, dtype, pml, geometry_cache, ...)
+    :return: dictionary with the parameters and the results (see COLUMNS). gain is the maximum of the
+             XZ and YZ radiation patterns (approximately calibrated to dBi), front_to_back the ratio
+             between the +z and -z directions in dB.
+    """
+    radius, height, feed, f = parameters
+    w = fdtd_yee_metal.dipole_simulation(True, n, f, far_field, radius, height, feed, **kwargs)
+    w.run(int(numpy.ceil(w.int_stop)))
+    xz = w.pattern_xz / w.npattern
+    yz = w.pattern_yz / w.npattern
+    # in the XZ and YZ planes, the +z direction is at phi = 90 deg and -z at phi = 270 deg
+    front = numpy.argmin(numpy.abs(w.phi - numpy.pi/2))
+    back = numpy.argmin(numpy.abs(w.phi - 3*numpy.pi/2))
+    result = dict(radius=radius, height=height, feed=feed, frequency=f,
+                  gain=10*numpy.log10(max(numpy.max(xz), numpy.max(yz))),
+                  front_to_back=10*numpy.log10((xz[front] + yz[front]) / (xz[back] + yz[back])),
+                  directivity=numpy.nan)
+    if far_field:
+        theta, phi = numpy.meshgrid(numpy.linspace(0, numpy.pi, 37), numpy.linspace(0, 2*numpy.pi, 72, endpoint=False),
+                                    indexing='ij')
+        result['directivity'] = numpy.max(w.ntff.directivity(theta, phi))
+    return result
+
+
+def _probe(parameters, n, steps, far_field, kwargs):
+    radius, height, feed, f = parameters
+    w = fdtd_yee_metal.dipole_simulation(True, n, f, far_field, radius, height, feed, **kwargs)
+    # the steps during the integration of the radiation patterns on the whole grid use the most memory
+    w.index = int(numpy.ceil(w.int_start))
+    for i in range(steps):
+        w.step()
+    return profiler.peak_memory()
+
+
+def memory_per_run(parameters, n=100, far_field=False, steps=2, **kwargs):
+    """
+    Measure the memory used by one simulation: peak memory of a new process running a few time steps
+    of the simulation, with the fields, the absorbing boundary layers, the near to far field
+    accumulators, the work buffers, the numba kernels and the interpreter itself
+    :param parameters: (can radius, can height, feed height, frequency), see simulate
+    :param steps: number of time steps run
+    :param kwargs: further arguments of dipole_simulation
+    :return: memory in bytes, nan if unknown (Windows)
+    """
+    with concurrent.futures.ProcessPoolExecutor(1) as executor:
+        return executor.submit(_probe, parameters, n, steps, far_field, kwargs).result()
+
+
+def sweep(radii, heights, feeds, frequencies, n=100, workers=None, memory=None, **kwargs):
+    """
+    Simulate all combinations of the parameters on a process pool
+    :param radii, heights, feeds: lists of can radii, can heights and feed heights in m
+    :param frequencies: list of frequencies in Hz. The space step is c/f/8 (see dipole_simulation), so
+                        the domain of n x n x n voxels shrinks as the frequency increases and the can
+                        covers more voxels.
+    :param workers: maximum number of processes, default is the number of CPUs
+    :param memory: memory budget in bytes, limits the number of processes running simultaneously to
+                   the budget divided by the memory of the first combination (see memory_per_run), not
+                   limited where the memory cannot be measured (Windows)
+    :param kwargs: further arguments of simulate
+    :return: list of results (see simulate) in the order of itertools.product(radii, heights, feeds, frequencies)
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    parameters = list(itertools.product(radii, heights, feeds, frequencies))
+    if memory is not None:
+        per_run = memory_per_run(parameters[0], n, **kwargs)
+        if not numpy.isnan(per_run):
+            workers = min(workers, max(1, int(memory // per_run)))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(simulate, p, n, **kwargs) for p in parameters]
+        return [future.result() for future in futures]
+
+
+def save(results, filename):
+    """
+    Save the results of sweep as a csv table
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Parameter sweep of the cantenna geometry')
+    parser.add_argument('--radius', type=float, nargs='+', default=[0.095/2], help='internal radii of the can in m')
+    parser.add_argument('--height', type=float, nargs='+', default=[0.133], help='internal heights of the can in m')
+    parser.add_argument('--feed', type=float, nargs='+', default=[0.06],
+                        help='distances of the dipole from the bottom of the can in m')
+    parser.add_argument('--frequency', type=float, nargs='+', default=[2.4e9], help='frequencies in Hz')
+    parser.add_argument('-n', type=int, default=100, help='grid size n x n x n')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, default is the number of CPUs')
+    parser.add_argument('--memory', type=float, default=None, help='memory budget in GB')
+    parser.add_argument('--far-field', action='store_true', help='also calculate the directivity with the near to far field transformation')
+    parser.add_argument('--courant', type=float, default=0.1*numpy.sqrt(3),
+                        help='Courant number, fraction of the largest stable time step')
+    parser.add_argument('--pml', type=int, default=0, help='thickness in voxels of the absorbing boundary layer')
+    parser.add_argument('--backend', choices=['numpy', 'numba'], default='numpy', help='implementation of the time step')
+    parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64', help='floating point type of the fields')
+    parser.add_argument('--output', default='sweep.csv', help='csv file in which the results are saved')
+    parser.add_argument('--geometry-cache', default=None,
+                        help='directory in which the metal of each geometry is saved and reused by later sweeps')
+    args = parser.parse_args()
+
+    results = sweep(args.radius, args.height, args.feed, args.frequency, args.n, args.workers,
+                    None if args.memory is None else args.memory * 2**30, far_field=args.far_field,
+                    courant=args.courant, pml=args.pml, backend=args.backend, dtype=numpy.dtype(args.dtype),
+                    geometry_cache=args.geometry_cache)
+    save(results, args.output)
+    for r in results:
+        print(', '.join('%s=%.4g' % (k, r[k]) for k in COLUMNS))
@@ -0,0 +1,44 @@
+import numpy, os
+import fdtd_yee_metal
+
+
+def simulation():
+    return fdtd_yee_metal.dipole_simulation(True, 30, pml=4, far_field=True)
+
+
+def test_checkpoint(tmp_path):
+    directory = os.fspath(tmp_path)
+    w = simulation()
+    w.run(20)
+    w.save_checkpoint(directory)
+    E, B, index = w.E.copy(), w.B.copy(), w.index
+    # the fields stepped after the checkpoint must not end up in the checkpoint files
+    w.run(15)
+    assert not numpy.array_equal(w.E, E)
+    saved = numpy.load(os.path.join(directory, 'E.npy'))
+    numpy.testing.assert_array_equal(saved, E)
+
+    resumed = simulation()
+    resumed.load_checkpoint(directory)
+    # copy-on-write memory maps of the checkpoint
+    assert isinstance(resumed.E, numpy.memmap) and resumed.E.mode == 'c'
+    assert resumed.index == index
+    numpy.testing.assert_array_equal(resumed.E, E)
+    numpy.testing.assert_array_equal(resumed.B, B)
+    # resuming gives the same fields as running without interruption
+    resumed.run(15)
+    assert resumed.index == w.index
+    numpy.testing.assert_allclose(resumed.E, w.E)
+    numpy.testing.assert_allclose(resumed.B, w.B)
+    numpy.testing.assert_array_equal(numpy.load(os.path.join(directory, 'E.npy')), E)
+    assert sorted(os.listdir(directory)) == ['B.npy', 'E.npy', 'state.npz']
+
+    # a new checkpoint in the directory the simulation was resumed from
+    resumed.save_checkpoint(directory)
+    resumed.run(5)
+    again = simulation()
+    again.load_checkpoint(directory)
+    assert again.index == index + 15
+    again.run(5)
+    numpy.testing.assert_array_equal(again.E, resumed.E)
+    numpy.testing.assert_array_equal(again.B, resumed.B)
@@ -0,0 +1,55 @@
+import numpy, pytest
+import fdtd_yee_metal, geometry
+
+SHAPE = (21, 18, 25)
+
+
+def assert_same_positions(mask):
+    positions = geometry.refine(mask)
+    reference = fdtd_yee_metal.refine_metal(mask)
+    assert len(positions) == len(reference) == 4
+    for p, r in zip(positions, reference):
+        assert numpy.array_equal(p, r)
+
+
+def test_refine_random():
+    random = numpy.random.default_rng(0)
+    assert_same_positions(random.random(SHAPE) < 0.3)
+
+
+def test_refine_upper_faces():
+    # the normal components at the upper faces of the grid are kept by refine_metal
+    mask = numpy.zeros(SHAPE, dtype=bool)
+    mask[-4:, 3:8, 5:9] = True
+    mask[2:6, -3:, 10:12] = True
+    mask[9:14, 7:11, -5:] = True
+    mask[-1, -1, -1] = True
+    assert_same_positions(mask)
+    assert_same_positions(numpy.ones(SHAPE, dtype=bool))
+    assert_same_positions(numpy.zeros(SHAPE, dtype=bool))
+
+
+def broadcast_cantenna(grid_dim, base, rmin, height, thickness, nodes=None):
+    # cantenna of fdtd_yee_metal before geometry, evaluated on the whole grid
+    if nodes is None:
+        nodes = [numpy.arange(n) for n in grid_dim]
+    x, y, z = nodes
+    r = numpy.sqrt((x[:,None]-base[0])**2+(y[None,:]-base[1])**2)
+    cylinder = ((r >= rmin) & (r <= (rmin+thickness)))[:,:,None] & ((z <= base[2] + height) & (z >= base[2]))[None,None,:]
+    bottom = (r <= (rmin+thickness))[:,:,None] & ((z <= base[2]) & (z >= base[2]-thickness))[None,None,:]
+    return cylinder | bottom
+
+
+@pytest.mark.parametrize('base, rmin, height, thickness', [
+    ((10, 9, 6), 5, 12, 1),
+    ((10.5, 8.3, 5.7), 4.6, 11.2, 1.5),
+    # the can crosses the faces of the grid
+    ((2.5, 16.2, 1.5), 6.3, 30, 2),
+])
+def test_cantenna(base, rmin, height, thickness):
+    mask = fdtd_yee_metal.cantenna(SHAPE, base, rmin, height, thickness)
+    assert numpy.array_equal(mask, broadcast_cantenna(SHAPE, base, rmin, height, thickness))
+    # graded mesh
+    nodes = [fdtd_yee_metal.grid_nodes(fdtd_yee_metal.graded_mesh(n, [(n / 3, n / 2)], 0.5)[:n]) for n in SHAPE]
+    mask = fdtd_yee_metal.cantenna(SHAPE, base, rmin, height, thickness, nodes)
+    assert numpy.array_equal(mask, broadcast_cantenna(SHAPE, base, rmin, height, thickness, nodes))
@@ -0,0 +1,115 @@
+import numpy, time, pytest
+pytest.importorskip('pty')
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.figure
+import esp32_simulator, serial_plotter
+
+
+class LimitedESP32(esp32_simulator.SimulatedESP32):
+    """
+    Simulated ESP32 stopping after a number of scans and keeping the lines it printed
+    """
+
+    def __init__(self, scans, **kwargs):
+        self.scans = scans
+        self.printed = []
+        esp32_simulator.SimulatedESP32.__init__(self, **kwargs)
+
+    def scan(self):
+        if len(self.printed) == self.scans:
+            return b''
+        lines = esp32_simulator.SimulatedESP32.scan(self)
+        self.printed.append(lines)
+        return lines
+
+
+def expected_points(device, source):
+    """
+    :return: power of the points of each trace (source, channel), averaged over the access points of the scan
+    """
+    points = {}
+    for lines in device.printed:
+        scan = {}
+        for line in lines.splitlines(keepends=True):
+            record = serial_plotter.parse_line(line, 0, source)
+            if isinstance(record, serial_plotter.AccessPoint):
+                scan.setdefault(record.channel, []).append(record.rssi)
+        for channel, rssi in scan.items():
+            points.setdefault((source, channel), []).append(numpy.average(rssi))
+    return points
+
+
+def test_simulated_devices():
+    scans = 300
+    devices = [LimitedESP32(scans, access_points=20, scan_rate=200, seed=i) for i in range(2)]
+    try:
+        plotter = serial_plotter.SerialPlotter([device.port for device in devices])
+        try:
+            figure = matplotlib.figure.Figure()
+            plotter(figure, 10, initial=True)
+            # plot until all the scans printed by the devices have been received
+            expected = None
+            deadline = time.time() + 30
+            while time.time() < deadline:
+                time.sleep(0.05)
+                plotter(figure, 10)
+                if all(len(device.printed) == scans for device in devices):
+                    expected = {}
+                    for source, device in enumerate(devices):
+                        expected.update(expected_points(device, source))
+                    received = {key: len(trace.points) for key, trace in plotter.traces.items()}
+                    if received == {key: len(points) for key, points in expected.items()}:
+                        break
+        finally:
+            plotter.close()
+    finally:
+        for device in devices:
+            device.close()
+    assert set(plotter.traces) == set(expected)
+    for key, trace in plotter.traces.items():
+        points = trace.points.take(numpy.arange(len(trace.points)))
+        numpy.testing.assert_allclose(points[:, 1], expected[key])
+        assert numpy.all(numpy.diff(points[:, 0]) >= 0)
+
+
+class FailingStream:
+    """
+    Serial port failing at the first read, e.g. when the device is unplugged
+    """
+    in_waiting = 0
+    closed = False
+
+    def read(self, size):
+        raise OSError('device disconnected')
+
+    def close(self):
+        self.closed = True
+
+
+def test_reader_error():
+    stream = FailingStream()
+    plotter = serial_plotter.SerialPlotter()
+    reader = serial_plotter.SerialReader(stream, plotter.records)
+    plotter.readers.append(reader)
+    reader.thread.join(5)
+    try:
+        with pytest.raises(OSError, match='device disconnected'):
+            plotter(matplotlib.figure.Figure(), 10, initial=True)
+    finally:
+        plotter.close()
+    assert stream.closed
+
+
+def test_replay_stop(tmp_path):
+    # a capture with one minute between its two lines
+    name = str(tmp_path / 'capture')
+    capture = serial_plotter.Capture(name)
+    capture.write(b'Scan complete, found 0 APs\n', 0.0)
+    capture.write(b'Scan complete, found 0 APs\n', 60.0)
+    capture.close()
+    plotter = serial_plotter.SerialPlotter(replay=[name])
+    time.sleep(0.1)
+    start = time.time()
+    plotter.close()
+    assert time.time() - start < 5
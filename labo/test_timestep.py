@@ -0,0 +1,73 @@
+import numpy, pytest
+import fdtd_yee_metal
+
+SHAPE = (23, 17, 20, 3)
+C = 0.5 / numpy.sqrt(3)
+
+
+def fields():
+    random = numpy.random.default_rng(0)
+    return random.standard_normal(SHAPE), random.standard_normal(SHAPE)
+
+
+def metal():
+    is_metal = numpy.zeros(SHAPE[:3], dtype=bool)
+    is_metal[5:12, 3:9, 8:15] = True
+    return fdtd_yee_metal.refine_metal(is_metal)
+
+
+def source():
+    # a dipole along z next to the metal block
+    z = numpy.arange(8, 12)
+    return (numpy.full(len(z), 15), numpy.full(len(z), 6), z, numpy.full(len(z), 2)), 0.3
+
+
+def spacing():
+    return [fdtd_yee_metal.graded_mesh(n, [(n / 3, n / 2)], 0.5)[:n] for n in SHAPE[:3]]
+
+
+def speed_of_light(h):
+    # stable on the finest cells of a graded mesh
+    return C if h is None else C * min(numpy.min(x) for x in h)
+
+
+def run(timestep, c, steps=3, **kwargs):
+    E, B = fields()
+    source_pos, source_val = source()
+    metal_pos = metal()
+    for i in range(steps):
+        E, B = timestep(E, B, c, source_pos, source_val, metal_pos, **kwargs)
+    return E, B
+
+
+def assert_identical(result, reference):
+    for F, R in zip(result, reference):
+        assert numpy.array_equal(F, R)
+
+
+@pytest.mark.parametrize('graded', [False, True])
+def test_backends(graded):
+    h = spacing() if graded else None
+    c = speed_of_light(h)
+    reference = run(fdtd_yee_metal.timestep, c, spacing=h)
+    assert_identical(run(fdtd_yee_metal.timestep, c, work=fdtd_yee_metal.work_buffers(SHAPE), spacing=h), reference)
+    # the whole grid as region
+    assert_identical(run(fdtd_yee_metal.timestep, c, region=((0, 0, 0), SHAPE[:3]), spacing=h), reference)
+    assert_identical(run(fdtd_yee_metal.SlabTimestep(SHAPE, 4, spacing=h), c), reference)
+
+    region = ((4, 2, 6), (19, 14, 17))
+    reference = run(fdtd_yee_metal.timestep, c, region=region, spacing=h)
+    assert_identical(run(fdtd_yee_metal.timestep, c, work=fdtd_yee_metal.work_buffers(SHAPE), region=region,
+                         spacing=h), reference)
+    assert_identical(run(fdtd_yee_metal.SlabTimestep(SHAPE, 4, spacing=h), c, region=region), reference)
+
+
+@pytest.mark.parametrize('graded', [False, True])
+def test_numba(graded):
+    pytest.importorskip('numba')
+    import fdtd_numba
+    h = spacing() if graded else None
+    c = speed_of_light(h)
+    for region in [None, ((4, 2, 6), (19, 14, 17))]:
+        reference = run(fdtd_yee_metal.timestep, c, region=region, spacing=h)
+        assert_identical(run(fdtd_numba.NumbaTimestep(SHAPE, spacing=h), c, region=region), reference)